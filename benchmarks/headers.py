@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Benchmark setting response headers and listing them for WSGI.
+
+Run from the repository root: python benchmarks/headers.py
+"""
+
+from __future__ import print_function
+from malt import Response
+import sys
+import timeit
+
+
+def build():
+    response = Response('x')
+    for i in range(6):
+        response.headers.add('Set-Cookie', 'c{0:d}=1'.format(i))
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Vary'] = 'Origin'
+    return response
+
+
+RESPONSE = build()
+
+
+def listing():
+    list(RESPONSE.headers)
+
+
+def main():
+    n = 20000
+    for fn in (build, listing):
+        seconds = min(timeit.repeat(fn, number=n, repeat=5))
+        print('{0:>7}: {1:.2f} us/response'.format(
+            fn.__name__, seconds / n * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
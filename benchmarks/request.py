@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Benchmark building requests and reading their derived fields.
+
+Run from the repository root: python benchmarks/request.py
+"""
+
+from __future__ import print_function
+from malt import Request
+import io
+import sys
+import timeit
+import tracemalloc
+
+ENVIRON = {
+    'REQUEST_METHOD': 'GET',
+    'PATH_INFO': '/tasks/12',
+    'SCRIPT_NAME': '',
+    'QUERY_STRING': 'a=1&b=2',
+    'SERVER_NAME': 'localhost',
+    'SERVER_PORT': '80',
+    'SERVER_PROTOCOL': 'HTTP/1.1',
+    'wsgi.url_scheme': 'http',
+    'HTTP_HOST': 'example.com',
+    'HTTP_COOKIE': 'session=abc; theme=dark',
+    'HTTP_ACCEPT': '*/*',
+    'CONTENT_LENGTH': '0',
+    'wsgi.input': io.BytesIO(),
+}
+
+
+def build():
+    Request(ENVIRON, {})
+
+
+def read():
+    request = Request(ENVIRON, {})
+    for _ in range(3):
+        request.url
+        request.host
+        request.cookies
+        request.data()
+
+
+def headers():
+    request = Request(ENVIRON, {})
+    for _ in range(2):
+        for name in ('Host', 'Accept', 'Cookie', 'Content-Length',
+                     'X-Missing'):
+            request.headers.get(name)
+    dict((key, request.headers[key]) for key in request.headers)
+
+
+def allocated(fn, n=1000):
+    """Return the bytes still allocated per request made by fn."""
+    kept = []
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(n):
+        kept.append(fn())
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / float(n)
+
+
+def main():
+    n = 100000
+    for fn in (build, read, headers):
+        seconds = min(timeit.repeat(fn, number=n, repeat=5))
+        print('{0:>7}: {1:.2f} us/request'.format(
+            fn.__name__, seconds / n * 1e6))
+    print('   size: {0:.0f} bytes/request'.format(
+        allocated(lambda: Request(ENVIRON, {}))))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
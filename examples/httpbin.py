@@ -13,10 +13,7 @@ def err_response(exc):
 
 
 def headers_dict(headers):
-    data = {}
-    for key in headers:
-        data[key] = headers[key]
-    return data
+    return dict(headers.items())
 
 
 @app.get('^/ip$')
@@ -43,7 +40,7 @@ def headers(request):
 @app.get('^/get$')
 def get(request):
     return json({
-        'args': {},
+        'args': request.args.to_dict(),
         'headers': headers_dict(request.headers),
         'origin': request.remote_addr,
         'url': request.url,
@@ -53,8 +50,9 @@ def get(request):
 @app.post('^/post$')
 def post(request):
     return json({
-        'args': {},
+        'args': request.args.to_dict(),
         'data': request.data(),
+        'form': request.form.to_dict(),
         'headers': headers_dict(request.headers),
         'origin': request.remote_addr,
         'url': request.url,
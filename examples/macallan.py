@@ -36,9 +36,8 @@ def create_task(request):
     return Response('/tasks/{0:d}'.format(task['id']))
 
 
-@app.get('^/tasks/(\d+)$')
+@app.get('^/tasks/<int>$')
 def get_task(request, task_id):
-    task_id = int(task_id)
     try:
         task = tasks[task_id]
     except IndexError:
@@ -8,7 +8,7 @@ Minimalistic WSGI framework.
 
 from .app import Malt
 from .exceptions import HTTPException
-from .models import Request, Response
+from .models import FileResponse, Request, Response
 from .util import json_response as json
 
 __author__ = 'Nick Frost'
@@ -2,35 +2,97 @@
 """This module contains the WSGI application object."""
 
 from .exceptions import HTTPException
-from .http import MIME_HTML
+from .http import HTTP_STATUS_CODES, MIME_HTML
+from .metrics import Metrics
 from .models import Request, Response
+from .profiling import Sampler
 from .routing import Router
+from .util import json_response, json_stream_response, ndjson_response
 from .sessions import open_session, save_session
+from .static import StaticFiles
+from .timing import monotonic, Timer
 import traceback
 try:
     from urllib.parse import urlencode
 except ImportError:
     from urllib import urlencode
+try:
+    from types import MappingProxyType
+except ImportError:
+    # No read-only mapping on Python 2, so the config is just copied
+    MappingProxyType = dict
+
+
+ERROR_PAGE = '''<!doctype html>
+<html>
+<head><title>{status_code} {message}</title></head>
+<body>
+<center><h1>{status_code} {message}</h1></center>
+</body>
+</html>
+'''
 
 
 class Malt(object):
 
-    """The application object."""
+    """The application object.
+
+    request_class is the class requests are wrapped in. json_backend
+    and json_sort_keys are the JSON settings; see malt.jsonlib.
+    """
+
+    request_class = Request
+    json_backend = None
+    json_sort_keys = True
 
     def __init__(self):
         self.router = Router()
         self._error_handler = self.default_error_handler
         self._before_request = []
         self._after_request = []
+        self._timing_handlers = []
+        self._error_pages = {}
+        self.metrics = None
+        self.profiler = None
+        self._frozen = False
+
+    def url_for(self, view, *args, **query):
+        """Return the url for a particular view function.
 
-    def url_for(self, view):
-        """Return the url for a particular view function."""
-        url = self.router.path_for(view)
+        The args fill the groups of the view's rule, in order, and any
+        keyword arguments are added as the query string.
+        """
+        url = self.router.build(view, args)
+        if query:
+            url += '?' + urlencode(sorted(query.items()), doseq=True)
         return url
 
+    def _check_frozen(self):
+        if self._frozen:
+            raise RuntimeError('The app is frozen')
+
+    def json_response(self, data, pretty=False, **kwargs):
+        """Return a JSON Response, using the app's encoder settings."""
+        kwargs.setdefault('backend', self.json_backend)
+        kwargs.setdefault('sort_keys', self.json_sort_keys)
+        return json_response(data, pretty, **kwargs)
+
+    def json_stream_response(self, items, **kwargs):
+        """Stream items as a JSON array, using the app's encoder."""
+        kwargs.setdefault('backend', self.json_backend)
+        kwargs.setdefault('sort_keys', self.json_sort_keys)
+        return json_stream_response(items, **kwargs)
+
+    def ndjson_response(self, items, **kwargs):
+        """Stream items as NDJSON, using the app's encoder."""
+        kwargs.setdefault('backend', self.json_backend)
+        kwargs.setdefault('sort_keys', self.json_sort_keys)
+        return ndjson_response(items, **kwargs)
+
     def method_router(method):
         def route(self, url):
             def add(fn):
+                self._check_frozen()
                 self.router.add_rule(method, url, fn)
                 return fn
             return add
@@ -44,18 +106,19 @@ class Malt(object):
     del method_router
 
     def default_error_handler(self, exception):
-        html = '''<!doctype html>
-<html>
-<head><title>{status_code} {message}</title></head>
-<body>
-<center><h1>{status_code} {message}</h1></center>
-</body>
-</html>
-'''.format(status_code=exception.status_code, message=exception.message)
-        return Response(html, code=exception.status_code, mimetype=MIME_HTML)
+        code = exception.status_code
+        html = self._error_pages.get(code)
+        if html is None or exception.message != HTTP_STATUS_CODES[code]:
+            html = ERROR_PAGE.format(status_code=code,
+                                     message=exception.message)
+            # Only the stock messages are cached, to keep the cache bounded
+            if exception.message == HTTP_STATUS_CODES[code]:
+                self._error_pages[code] = html
+        return Response(html, code=code, mimetype=MIME_HTML)
 
     def error_handler(self, fn):
         """Register a new error handler, replacing the existing one."""
+        self._check_frozen()
         self._error_handler = fn
         return fn
 
@@ -74,24 +137,90 @@ class Malt(object):
     save_session = staticmethod(save_session)
 
     def before_request(self, fn):
+        self._check_frozen()
         self._before_request.append(fn)
 
     def after_request(self, fn):
+        self._check_frozen()
         self._after_request.append(fn)
 
+    def timing_handler(self, fn):
+        """Register fn(request, response, timer) to get stage timings.
+
+        Timing is off unless a handler is registered, or config has
+        SERVER_TIMING set, which also adds a Server-Timing header.
+        """
+        self._check_frozen()
+        self._timing_handlers.append(fn)
+        return fn
+
+    def static(self, url_prefix, directory, **kwargs):
+        """Serve the files in directory under url_prefix.
+
+        The prefix is matched ahead of the regex routes. kwargs go to
+        malt.static.StaticFiles, which is returned.
+        """
+        self._check_frozen()
+        if not url_prefix.endswith('/'):
+            url_prefix += '/'
+        view = StaticFiles(directory, **kwargs)
+        self.router.mount(url_prefix, view)
+        return view
+
+    def enable_metrics(self, path=None):
+        """Start collecting per-route metrics, in self.metrics.
+
+        If path is given, a GET route is added there to serve them.
+        """
+        self._check_frozen()
+        self.metrics = Metrics(self.router)
+        if path is not None:
+            self.router.add_rule('GET', path, self.metrics.view)
+        return self.metrics
+
+    def enable_profiling(self, every=100, paths=(), slow=None, capacity=50):
+        """Profile 1 in every requests, and those matching paths.
+
+        Profiles are kept in self.profiler; see malt.profiling.Sampler.
+        """
+        self._check_frozen()
+        self.profiler = Sampler(self.router, every, paths, slow, capacity)
+        return self.profiler
+
+    def start_timing(self, request):
+        if self._timing_handlers or request.config.get('SERVER_TIMING'):
+            request.timer = Timer()
+
+    def finish_timing(self, request, response):
+        timer = request.timer
+        timer.finish()
+        if request.config.get('SERVER_TIMING'):
+            response.headers['Server-Timing'] = timer.header()
+        for fn in self._timing_handlers:
+            try:
+                fn(request, response, timer)
+            except Exception:
+                traceback.print_exc()
+
     def call_view(self, request):
         """Determine the correct view function, and call it."""
         # URL endpoint matching
-        try:
-            view, args = self.router.get_view(request.method, request.path)
-        except LookupError as exc:
-            if exc.args[0] == 'No such path':
-                raise HTTPException(404, exception=exc)
-            elif exc.args[0] == 'No such method':
-                raise HTTPException(405, exception=exc)
-            else:
-                raise
-        return view(request, *args)
+        view, args, allow = self.router.match(request.method, request.path)
+        if request.timer is not None:
+            request.timer.mark('routing')
+        if view is not None:
+            request.view = view
+            return view(request, *args)
+        return self.routing_error(allow)
+
+    def routing_error(self, allow):
+        """Return the 404, or 405 if allow is set, for a routing miss."""
+        # Misses are common enough that we skip raising an exception
+        if allow is None:
+            return self.handle_error(HTTPException(404))
+        response = self.handle_error(HTTPException(405))
+        response.headers['Allow'] = allow
+        return response
 
     def get_response(self, fn, *args):
         """Call fn using args. Handle any errors."""
@@ -102,25 +231,122 @@ class Malt(object):
         return response
 
     def dispatch(self, request):
+        timer = request.timer
+        response = None
         for fn in self._before_request:
             response = self.get_response(fn, request)
             if response is not None:
                 break
-        else:
+        if timer is not None:
+            timer.mark('before')
+        if response is None:
             response = self.get_response(self.call_view, request)
+            if timer is not None:
+                timer.mark('view')
         for fn in self._after_request:
             response = self.get_response(fn, request, response)
+        if timer is not None:
+            timer.mark('after')
         return response
 
     def wsgi_app(self, config):
         def callable(environ, start_response):
+            metrics = self.metrics
+            if metrics is not None:
+                started = monotonic()
             use_sessions = config.get('SESSIONS', False)
-            request = Request(environ, dict(config))
+            request = self.request_class(environ, dict(config))
+            request.json_backend = self.json_backend
+            self.start_timing(request)
             if use_sessions:
                 request.session = self.open_session(request)
-            response = self.dispatch(request)
+                if request.timer is not None:
+                    request.timer.mark('session_open')
+            if self.profiler is not None:
+                response = self.profiler.run(self.dispatch, request)
+            else:
+                response = self.dispatch(request)
             if use_sessions:
                 self.save_session(request, response)
+                if request.timer is not None:
+                    request.timer.mark('session_save')
+            if request.timer is not None:
+                self.finish_timing(request, response)
+            if metrics is not None:
+                metrics.record(request, response, monotonic() - started)
+            body = response.prepare(environ)
             start_response(response.status, list(response.headers))
-            return response
+            return body
+        return callable
+
+    def freeze(self, config):
+        """Return a WSGI callable specialized for the app as it is now.
+
+        The config is copied into a read-only mapping shared by every
+        request, the hooks are bound up front, and the session handling is
+        left out when sessions are off. Adding routes or hooks afterwards
+        raises RuntimeError.
+        """
+        self._frozen = True
+        self.router.frozen = True
+        self.router.compile()
+        config = MappingProxyType(dict(config))
+        if self.metrics is not None or self.profiler is not None or \
+                self._timing_handlers or config.get('SERVER_TIMING'):
+            # Nothing to gain over the generic path
+            return self.wsgi_app(config)
+
+        before = tuple(self._before_request)
+        after = tuple(self._after_request)
+        get_response = self.get_response
+        call_view = self.call_view
+        request_class = self.request_class
+        json_backend = self.json_backend
+
+        if before or after:
+            def dispatch(request):
+                response = None
+                for fn in before:
+                    response = get_response(fn, request)
+                    if response is not None:
+                        break
+                if response is None:
+                    response = get_response(call_view, request)
+                for fn in after:
+                    response = get_response(fn, request, response)
+                return response
+        else:
+            def dispatch(request):
+                return get_response(call_view, request)
+
+        if config.get('SESSIONS', False):
+            open_session = self.open_session
+            save_session = self.save_session
+
+            def callable(environ, start_response):
+                request = request_class(environ, config)
+                request.json_backend = json_backend
+                request.session = open_session(request)
+                response = dispatch(request)
+                save_session(request, response)
+                body = response.prepare(environ)
+                start_response(response.status, list(response.headers))
+                return body
+        else:
+            def callable(environ, start_response):
+                request = request_class(environ, config)
+                request.json_backend = json_backend
+                response = dispatch(request)
+                body = response.prepare(environ)
+                start_response(response.status, list(response.headers))
+                return body
         return callable
+
+    def asgi_app(self, config):
+        """Return an ASGI application, for Python 3.7 and later.
+
+        Views and hooks may be coroutine functions. Regular views are run
+        in a thread pool, of config['ASGI_THREADS'] threads.
+        """
+        from .asgi import ASGIApp
+        return ASGIApp(self, config)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""ASGI support.
+
+The ASGI application reuses the router, hooks, sessions and response
+objects of a regular Malt app. Views and hooks may be coroutine
+functions, which run on the event loop. Regular views run in a bounded
+thread pool, so they can block without holding up other requests.
+
+This module needs Python 3.7 or later, so the package doesn't import it.
+"""
+
+from .helpers import want_bytes
+from .timing import monotonic
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import inspect
+import sys
+
+
+_END = object()
+
+
+def build_environ(scope, body):
+    """Translate an ASGI HTTP scope into a WSGI environ."""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        # PATH_INFO holds the raw bytes as latin1 in WSGI, so routes
+        # behave the same under both
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The body ends when the client says so, with or without a length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'asgi.scope': scope,
+    }
+    server = scope.get('server')
+    if server:
+        environ['SERVER_NAME'] = server[0]
+        environ['SERVER_PORT'] = str(server[1])
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'] = client[0]
+    for name, value in scope.get('headers', ()):
+        key = name.decode('latin1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin1')
+        if key in environ:
+            value = environ[key] + ',' + value
+        environ[key] = value
+    return environ
+
+
+class RequestBody(object):
+
+    """The wsgi.input stream of an ASGI request.
+
+    The body is pulled from the ASGI receive callable as it's read. Views
+    running in the thread pool can call read() like on any stream. On the
+    event loop, use ``await aread()``, or ``await load()`` to buffer the
+    whole body so that read() and ``request.data()`` work.
+    """
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self._more = True
+
+    async def _fill(self, size):
+        while self._more and (size < 0 or len(self._buffer) < size):
+            message = await self._receive()
+            if message['type'] == 'http.disconnect':
+                self._more = False
+                raise IOError('Client disconnected')
+            self._buffer += message.get('body', b'')
+            self._more = message.get('more_body', False)
+
+    def _take(self, size):
+        if size < 0 or size >= len(self._buffer):
+            data = bytes(self._buffer)
+            del self._buffer[:]
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        return data
+
+    def _on_loop(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    async def aread(self, size=-1):
+        """Read up to size bytes, or the rest of the body by default."""
+        await self._fill(size)
+        return self._take(size)
+
+    async def load(self):
+        """Buffer the rest of the body, without consuming it."""
+        await self._fill(-1)
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        if self._more and (size < 0 or len(self._buffer) < size):
+            if self._on_loop():
+                raise RuntimeError('Call "await request.stream.load()" before'
+                                   ' reading the body from a coroutine')
+            asyncio.run_coroutine_threadsafe(self._fill(size),
+                                             self._loop).result()
+        return self._take(size)
+
+
+class ASGIApp(object):
+
+    """ASGI application wrapping a Malt app."""
+
+    def __init__(self, app, config):
+        self.app = app
+        self.config = config
+        self._executor = None
+
+    @property
+    def executor(self):
+        # Created on first use, so that it doesn't get shared by forking
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self.config.get('ASGI_THREADS'))
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported scope type: ' + scope['type'])
+
+        metrics = self.app.metrics
+        if metrics is not None:
+            started = monotonic()
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, RequestBody(receive, loop))
+        use_sessions = self.config.get('SESSIONS', False)
+        request = self.app.request_class(environ, dict(self.config))
+        request.json_backend = self.app.json_backend
+        self.app.start_timing(request)
+        timer = request.timer
+        if use_sessions:
+            request.session = self.app.open_session(request)
+            if timer is not None:
+                timer.mark('session_open')
+        response = await self.dispatch(request)
+        if use_sessions:
+            self.app.save_session(request, response)
+            if timer is not None:
+                timer.mark('session_save')
+        if timer is not None:
+            self.app.finish_timing(request, response)
+        if metrics is not None:
+            metrics.record(request, response, monotonic() - started)
+        response.prepare(environ)
+        zerocopy = 'http.response.zerocopysend' in scope.get('extensions', {})
+        await self.send_response(response, send, loop, zerocopy)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                    self._executor = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def get_response(self, fn, *args):
+        """Call or await fn using args. Handle any errors."""
+        try:
+            if inspect.iscoroutinefunction(fn):
+                return await fn(*args)
+            return fn(*args)
+        except Exception as exc:
+            return self.app.handle_error(exc)
+
+    async def call_view(self, request):
+        """Determine the correct view function, and call it."""
+        view, args, allow = self.app.router.match(request.method,
+                                                  request.path)
+        if request.timer is not None:
+            request.timer.mark('routing')
+        if view is None:
+            return self.app.routing_error(allow)
+        request.view = view
+        if inspect.iscoroutinefunction(view):
+            return await self.get_response(view, request, *args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self.app.get_response, view, request, *args)
+
+    async def dispatch(self, request):
+        timer = request.timer
+        response = None
+        for fn in self.app._before_request:
+            response = await self.get_response(fn, request)
+            if response is not None:
+                break
+        if timer is not None:
+            timer.mark('before')
+        if response is None:
+            response = await self.call_view(request)
+            if timer is not None:
+                timer.mark('view')
+        for fn in self.app._after_request:
+            response = await self.get_response(fn, request, response)
+        if timer is not None:
+            timer.mark('after')
+        return response
+
+    async def send_response(self, response, send, loop, zerocopy=False):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(k.encode('latin1'), v.encode('latin1'))
+                        for k, v in response.headers],
+        })
+        body = response.response
+        segments = getattr(response, 'segments', None)
+        try:
+            if zerocopy and segments is not None:
+                # A FileResponse; the server sends the file spans itself
+                for segment in segments:
+                    if segment.__class__ is bytes:
+                        await send({
+                            'type': 'http.response.body',
+                            'body': segment,
+                            'more_body': True,
+                        })
+                    else:
+                        await send({
+                            'type': 'http.response.zerocopysend',
+                            'file': response.file,
+                            'offset': segment[0],
+                            'count': segment[1],
+                            'more_body': True,
+                        })
+            elif hasattr(body, '__aiter__'):
+                async for chunk in body:
+                    await send({
+                        'type': 'http.response.body',
+                        'body': want_bytes(chunk, response.charset),
+                        'more_body': True,
+                    })
+            elif isinstance(body, (list, tuple)):
+                await send({
+                    'type': 'http.response.body',
+                    'body': b''.join(response),
+                })
+                return
+            else:
+                # Generators may block, so they're advanced in the pool
+                chunks = iter(response)
+                while True:
+                    chunk = await loop.run_in_executor(self.executor, next,
+                                                       chunks, _END)
+                    if chunk is _END:
+                        break
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(body, 'aclose'):
+                await body.aclose()
+            else:
+                response.close()
@@ -36,3 +36,31 @@ def unquote(string, encoding='utf-8', errors='replace'):
     if PY2:
         return unquote_native(string.encode('latin1')).decode(encoding, errors)
     return unquote_native(string, encoding, errors)
+
+
+def parse_qsl(string, encoding='utf-8', max_params=None):
+    """Split a query string into a list of (key, value) pairs.
+
+    Keys and values are unquoted, with '+' as a space. Raise ValueError if
+    there are more than max_params pairs.
+    """
+    pairs = []
+    if not string:
+        return pairs
+    for field in string.split('&'):
+        if not field:
+            continue
+        if max_params is not None and len(pairs) >= max_params:
+            raise ValueError('Too many parameters')
+        key, _, value = field.partition('=')
+        if '+' in key:
+            key = key.replace('+', ' ')
+        if '+' in value:
+            value = value.replace('+', ' ')
+        # Most keys and values don't need unquoting
+        if '%' in key:
+            key = unquote(key, encoding)
+        if '%' in value:
+            value = unquote(value, encoding)
+        pairs.append((key, value))
+    return pairs
@@ -72,4 +72,5 @@ HTTP_STATUS_CODES = {
 
 MIME_HTML = 'text/html; charset=utf-8'
 MIME_JSON = 'application/json; charset=utf-8'
+MIME_NDJSON = 'application/x-ndjson; charset=utf-8'
 MIME_PLAIN = 'text/plain; charset=utf-8'
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Pluggable JSON backends.
+
+Malt.json_backend picks the backend, both to decode request bodies in
+Request.json() and to encode responses from Malt.json_response() and
+the streaming variants. Malt.json_sort_keys sets whether those sort
+object keys. The module-level helpers, like malt.json(), take the same
+settings as arguments instead.
+
+A backend is the name of one below, or any object with the same two
+methods: loads(), which takes bytes or text, and dumps(obj, sort_keys,
+pretty), which returns UTF-8 bytes. The default is the standard library,
+and faster libraries are used when they're chosen and installed.
+"""
+
+from .helpers import is_string, PY2
+import json
+import sys
+
+# json.loads accepts bytes from Python 3.6 on
+_LOADS_BYTES = PY2 or sys.version_info >= (3, 6)
+
+
+class StdlibBackend(object):
+
+    """The json module from the standard library."""
+
+    name = 'json'
+
+    def loads(self, data):
+        if not _LOADS_BYTES and isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+    def dumps(self, obj, sort_keys=False, pretty=False, **kwargs):
+        """Encode obj; kwargs override the json.dumps options."""
+        if pretty:
+            kwargs.setdefault('ensure_ascii', True)
+            kwargs.setdefault('separators', (',', ': '))
+            kwargs.setdefault('indent', 2)
+        else:
+            kwargs.setdefault('ensure_ascii', False)
+            kwargs.setdefault('separators', (',', ':'))
+        text = json.dumps(obj, sort_keys=sort_keys, **kwargs)
+        return text.encode('utf-8')
+
+
+class OrjsonBackend(object):
+
+    """orjson, which works in bytes throughout."""
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def loads(self, data):
+        return self.orjson.loads(data)
+
+    def dumps(self, obj, sort_keys=False, pretty=False):
+        option = 0
+        if sort_keys:
+            option |= self.orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= self.orjson.OPT_INDENT_2
+        return self.orjson.dumps(obj, option=option)
+
+
+class UjsonBackend(object):
+
+    """ujson."""
+
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self.ujson = ujson
+
+    def loads(self, data):
+        return self.ujson.loads(data)
+
+    def dumps(self, obj, sort_keys=False, pretty=False):
+        return self.ujson.dumps(obj, sort_keys=sort_keys,
+                                indent=2 if pretty else 0,
+                                ensure_ascii=pretty,
+                                escape_forward_slashes=False).encode('utf-8')
+
+
+_FACTORIES = {
+    'json': StdlibBackend,
+    'orjson': OrjsonBackend,
+    'ujson': UjsonBackend,
+}
+_backends = {}
+
+
+def get_backend(backend=None):
+    """Return the backend called backend, 'json' by default.
+
+    Backends that aren't names are returned as they are. An ImportError
+    is raised if the named backend isn't installed.
+    """
+    if backend is None:
+        backend = 'json'
+    elif not is_string(backend):
+        return backend
+    instance = _backends.get(backend)
+    if instance is None:
+        try:
+            factory = _FACTORIES[backend]
+        except KeyError:
+            raise ValueError('Unknown JSON backend: {0!r}'.format(backend))
+        instance = _backends[backend] = factory()
+    return instance
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""In-process per-route request metrics.
+
+For every route pattern, as stored in ``Router.view_map``, this counts
+requests, responses by status class, and request durations in a histogram
+with fixed buckets. Requests that didn't match a route are counted under
+'<unmatched>'.
+
+All the counters live in one flat array of integers. Under the pre-fork
+server, the array is an anonymous shared mmap made before forking, with
+a region for each worker, so a scrape from any worker sees the totals for
+the whole machine. Each process only writes to its own region.
+"""
+
+from .http import MIME_PLAIN
+from .models import Response
+from bisect import bisect_left
+import mmap
+import threading
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED = '<unmatched>'
+
+# Each route gets a record of: request count, 1xx-5xx counts, one count per
+# bucket plus +Inf, and the sum of durations in microseconds
+_STATUS = 1
+_BUCKET = _STATUS + 5
+_SUM = _BUCKET + len(BUCKETS) + 1
+_FIELDS = _SUM + 1
+
+
+class Metrics(object):
+
+    """Per-route counters and latency histograms."""
+
+    def __init__(self, router):
+        self.router = router
+        self._slots = {UNMATCHED: 0}
+        self._values = [0] * _FIELDS
+        self._regions = 1
+        self._offset = 0
+        self._shared = None
+        self._lock = threading.Lock()
+
+    def share(self, regions):
+        """Move the counters to shared memory, with a region per process.
+
+        The set of routes is fixed from here on; routes added later are
+        counted as unmatched.
+        """
+        for _, path in self.router.view_map.values():
+            self._slots.setdefault(path, len(self._slots))
+        size = regions * len(self._slots) * _FIELDS
+        self._shared = mmap.mmap(-1, size * 8)
+        values = memoryview(self._shared).cast('Q')
+        for i, value in enumerate(self._values):
+            values[i] = value
+        self._values = values
+        self._regions = regions
+
+    def bind(self, region):
+        """Write this process's counts to the given region."""
+        self._offset = region * len(self._slots) * _FIELDS
+
+    def route_for(self, request):
+        if request.view is None:
+            return UNMATCHED
+        return self.router.path_for(request.view)
+
+    def record(self, request, response, duration):
+        """Count a finished request, that took duration seconds."""
+        route = self.route_for(request)
+        status = response.status_code // 100
+        bucket = bisect_left(BUCKETS, duration)
+        with self._lock:
+            slot = self._slots.get(route)
+            if slot is None:
+                if self._shared is not None:
+                    slot = 0
+                else:
+                    slot = self._slots[route] = len(self._slots)
+                    self._values.extend([0] * _FIELDS)
+            base = self._offset + slot * _FIELDS
+            values = self._values
+            values[base] += 1
+            if 1 <= status <= 5:
+                values[base + _STATUS + status - 1] += 1
+            values[base + _BUCKET + bucket] += 1
+            values[base + _SUM] += int(duration * 1000000)
+
+    def snapshot(self):
+        """Return the totals, as {route: stats}."""
+        stride = len(self._slots) * _FIELDS
+        stats = {}
+        for route, slot in self._slots.items():
+            totals = [0] * _FIELDS
+            for region in range(self._regions):
+                base = region * stride + slot * _FIELDS
+                for i in range(_FIELDS):
+                    totals[i] += self._values[base + i]
+            if not totals[0]:
+                continue
+            cumulative = 0
+            buckets = []
+            for le, count in zip(BUCKETS + (float('inf'),),
+                                 totals[_BUCKET:_SUM]):
+                cumulative += count
+                buckets.append((le, cumulative))
+            stats[route] = {
+                'requests': totals[0],
+                'status': dict(('{0:d}xx'.format(i + 1), n) for i, n in
+                               enumerate(totals[_STATUS:_BUCKET]) if n),
+                'buckets': buckets,
+                'sum': totals[_SUM] / 1000000.0,
+            }
+        return stats
+
+    def exposition(self):
+        """Format the totals in the Prometheus text format."""
+        routes = []
+        for route, stats in sorted(self.snapshot().items()):
+            label = 'route="{0}"'.format(
+                route.replace('\\', '\\\\').replace('"', '\\"'))
+            routes.append((label, stats))
+        # Each metric family's samples have to be one contiguous group
+        lines = ['# TYPE malt_requests_total counter']
+        for label, stats in routes:
+            lines.append('malt_requests_total{{{0}}} {1:d}'.format(
+                label, stats['requests']))
+        lines.append('# TYPE malt_responses_total counter')
+        for label, stats in routes:
+            for status, count in sorted(stats['status'].items()):
+                lines.append('malt_responses_total{{{0},status="{1}"}} '
+                             '{2:d}'.format(label, status, count))
+        lines.append('# TYPE malt_request_duration_seconds histogram')
+        for label, stats in routes:
+            for le, count in stats['buckets']:
+                lines.append('malt_request_duration_seconds_bucket'
+                             '{{{0},le="{1}"}} {2:d}'.format(
+                                 label, '+Inf' if le == float('inf')
+                                 else repr(le), count))
+            lines.append('malt_request_duration_seconds_sum{{{0}}} '
+                         '{1!r}'.format(label, stats['sum']))
+            lines.append('malt_request_duration_seconds_count{{{0}}} '
+                         '{1:d}'.format(label, stats['requests']))
+        return '\n'.join(lines) + '\n'
+
+    def view(self, request):
+        """A view serving the exposition."""
+        return Response(self.exposition(), mimetype=MIME_PLAIN)
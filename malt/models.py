@@ -2,35 +2,88 @@
 """WSGI wrapper objects."""
 
 from .exceptions import HTTPException
-from .helpers import is_string, WSGI_WANT_BYTES, want_bytes, want_text, unquote
+from .helpers import (is_string, parse_qsl, WSGI_WANT_BYTES, want_bytes,
+                      want_text, unquote)
 from .http import HTTP_STATUS_CODES, MIME_PLAIN
-import json
+from .jsonlib import get_backend
+from .multipart import MultipartParser, parse_form, parse_options_header
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+import mimetypes
+import os
+import re
+import uuid
 try:
     from urllib.parse import quote
 except ImportError:
     from urllib import quote
 
 
+# Header names as spelled by callers, mapped to their environ keys, and
+# environ keys mapped to canonical names. Both are shared by all requests
+_ENVIRON_KEYS = {}
+_HEADER_NAMES = {}
+_MAX_NAMES = 1024
+
+
+def _environ_key(header):
+    key = _ENVIRON_KEYS.get(header)
+    if key is None:
+        key = header.upper().replace('-', '_')
+        if len(_ENVIRON_KEYS) < _MAX_NAMES:
+            _ENVIRON_KEYS[header] = key
+    return key
+
+
+def _header_name(key):
+    name = _HEADER_NAMES.get(key)
+    if name is None:
+        name = '-'.join(part.capitalize() for part in key.split('_'))
+        if len(_HEADER_NAMES) < _MAX_NAMES:
+            _HEADER_NAMES[key] = name
+    return name
+
+
 class EnvironHeaders(object):
 
-    """Read the headers from environ."""
+    """Read the headers from environ.
+
+    The first lookup indexes all the headers in one pass over environ,
+    decoding each value once.
+    """
+
+    __slots__ = ('environ', '_index')
 
     def __init__(self, environ):
         self.environ = environ
+        self._index = None
+
+    def _build(self):
+        index = {}
+        for env_key, value in self.environ.items():
+            if env_key.startswith('HTTP_'):
+                key = env_key[5:]
+                # Content-Type and Content-Length are in the environ
+                if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                    continue
+            elif env_key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = env_key
+            else:
+                continue
+            index[key] = want_text(value, charset='latin1', errors='replace')
+        self._index = index
+        return index
 
     def __getitem__(self, header):
         """Convert to WSGI naming scheme.
 
         'X-Forwarded-For' returns the value of HTTP_X_FORWARDED_FOR
         """
+        index = self._index
+        if index is None:
+            index = self._build()
         try:
-            key = header.upper().replace('-', '_')
-            # Content-Type and Content-Length are in the environ
-            if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
-                value = self.environ[key]
-            else:
-                value = self.environ['HTTP_' + key]
-            return want_text(value, charset='latin1', errors='replace')
+            return index[_environ_key(header)]
         except KeyError:
             # Use the original header key in the exception message
             raise KeyError(header)
@@ -44,14 +97,23 @@ class EnvironHeaders(object):
 
     def __iter__(self):
         """Iterate through header keys (same behavior as a dict)."""
-        for env_key in self.environ:
-            if env_key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
-                key = env_key
-            elif env_key.startswith('HTTP_'):
-                key = env_key[5:]
-            else:
-                continue  # pragma: no cover
-            yield '-'.join(part.capitalize() for part in key.split('_'))
+        index = self._index
+        if index is None:
+            index = self._build()
+        return (_header_name(key) for key in index)
+
+    def __len__(self):
+        index = self._index
+        if index is None:
+            index = self._build()
+        return len(index)
+
+    def items(self):
+        """Return a list of (name, value) pairs."""
+        index = self._index
+        if index is None:
+            index = self._build()
+        return [(_header_name(key), value) for key, value in index.items()]
 
     def get(self, key, default=None):
         try:
@@ -59,6 +121,28 @@ class EnvironHeaders(object):
         except KeyError:
             return default
 
+    def getlist(self, key):
+        """Return the values of a header sent several times.
+
+        Servers join repeated headers with commas, so this splits them
+        again. Don't use it on headers whose values may contain commas,
+        like dates.
+        """
+        try:
+            value = self.__getitem__(key)
+        except KeyError:
+            return []
+        return [part.strip() for part in value.split(',')]
+
+
+def _wsgi_str(value):
+    """Convert a header name or value to the native string WSGI wants."""
+    if value.__class__ is str:
+        return value
+    if WSGI_WANT_BYTES:
+        return want_bytes(value, 'latin1')
+    return want_text(value, 'utf-8')
+
 
 class Headers(object):
 
@@ -73,70 +157,179 @@ class Headers(object):
     >>> headers['X-Green] = ['eggs', 'spam']
     >>> list(headers)
     [('X-Abc', 'apple'), ('X-Green', 'eggs'), ('X-Green', 'spam')]
+
+    Entries live in three parallel lists: the upper-cased key, the value
+    as it was given, and the (name, value) pair ready for start_response.
+    Values for the same header are kept next to each other.
     """
 
+    __slots__ = ('_keys', '_values', '_items')
+
     def __init__(self):
-        self._headers = {}
-        self._order = []
+        self._keys = []
+        self._values = []
+        self._items = []
 
     def _key_for(self, header):
-        key = header.upper()
-        if WSGI_WANT_BYTES:
-            return want_bytes(key, 'latin1')
-        else:
-            return want_text(key, 'utf-8')
-
-    def _ensure_contains(self, header):
-        """Raise a KeyError if the given header does not exist."""
-        if self._key_for(header) not in self._headers:
-            raise KeyError(header)
+        return _wsgi_str(header).upper()
+
+    def _insert(self, i, key, name, values):
+        for value in values:
+            self._keys.insert(i, key)
+            self._values.insert(i, value)
+            self._items.insert(i, (name, _wsgi_str(value)))
+            i += 1
+
+    def _append(self, key, name, value):
+        self._keys.append(key)
+        self._values.append(value)
+        self._items.append((name, _wsgi_str(value)))
+
+    def _remove(self, key, start):
+        """Remove the entries for key, starting at index start."""
+        keys = self._keys
+        end = start + 1
+        while end < len(keys) and keys[end] == key:
+            end += 1
+        del keys[start:end]
+        del self._values[start:end]
+        del self._items[start:end]
 
     def __getitem__(self, header):
         """Return the first vaue for the given header."""
-        self._ensure_contains(header)
+        try:
+            return self._values[self._keys.index(self._key_for(header))]
+        except ValueError:
+            raise KeyError(header)
 
-        values = self._headers[self._key_for(header)]
-        return values[0]
+    def __contains__(self, header):
+        return self._key_for(header) in self._keys
+
+    def get(self, header, default=None):
+        try:
+            return self.__getitem__(header)
+        except KeyError:
+            return default
 
     def __setitem__(self, header, value):
         """Value may be either a string, or an iterable of strings."""
         if is_string(value):
             value = [value]
 
-        if self._key_for(header) not in self._headers:
-            self._order.append(header)
-        self._headers[self._key_for(header)] = value
+        key = self._key_for(header)
+        if key not in self._keys:
+            name = _wsgi_str(header)
+            for item in value:
+                self._append(key, name, item)
+            return
+        # Replace the values in place, keeping the original name
+        i = self._keys.index(key)
+        name = self._items[i][0]
+        self._remove(key, i)
+        self._insert(i, key, name, value)
 
     def add(self, header, value):
         """Add a new key-value pair, without overwriting."""
         if not is_string(value):
             raise TypeError('Headers.add does not expect a list')
 
-        if self._key_for(header) not in self._headers:
-            self._order.append(header)
-            self._headers[self._key_for(header)] = []
-        self._headers[self._key_for(header)].append(value)
+        key = self._key_for(header)
+        keys = self._keys
+        if keys and keys[-1] == key:
+            self._append(key, self._items[-1][0], value)
+        elif key not in keys:
+            self._append(key, _wsgi_str(header), value)
+        else:
+            # After the last value of the same header
+            i = keys.index(key)
+            name = self._items[i][0]
+            i += 1
+            while keys[i] == key:
+                i += 1
+            self._insert(i, key, name, [value])
 
     def __delitem__(self, header):
-        """Remove the header from the dict, and from the order list."""
-        self._ensure_contains(header)
+        """Remove every value of the header."""
+        key = self._key_for(header)
+        try:
+            i = self._keys.index(key)
+        except ValueError:
+            raise KeyError(header)
+        self._remove(key, i)
 
-        header_key = self._key_for(header)
-        del self._headers[header_key]
-        self._order = [key for key in self._order
-                       if self._key_for(key) != header_key]
+    def __len__(self):
+        return len(self._items)
 
     def __iter__(self):
         """Yield each header-value pair."""
-        for header in self._order:
-            for value in self._headers[self._key_for(header)]:
-                if WSGI_WANT_BYTES:
-                    header_enc = want_bytes(header, 'latin1')
-                    value_enc = want_bytes(value, 'latin1')
-                else:
-                    header_enc = want_text(header, 'utf-8')
-                    value_enc = want_text(value, 'utf-8')
-                yield header_enc, value_enc
+        return iter(self._items)
+
+
+class MultiDict(object):
+
+    """An ordered dict that can hold several values per key.
+
+    >>> d = MultiDict([('a', '1'), ('b', '2'), ('a', '3')])
+    >>> d['a']
+    '1'
+    >>> d.getlist('a')
+    ['1', '3']
+    """
+
+    __slots__ = ('_lists', '_keys', '_items')
+
+    def __init__(self, items=()):
+        self._lists = {}
+        self._keys = []
+        self._items = []
+        for key, value in items:
+            self.add(key, value)
+
+    def add(self, key, value):
+        values = self._lists.get(key)
+        if values is None:
+            self._lists[key] = [value]
+            self._keys.append(key)
+        else:
+            values.append(value)
+        self._items.append((key, value))
+
+    def __getitem__(self, key):
+        """Return the first value for key."""
+        return self._lists[key][0]
+
+    def get(self, key, default=None):
+        values = self._lists.get(key)
+        if values is None:
+            return default
+        return values[0]
+
+    def getlist(self, key):
+        """Return every value for key, in order."""
+        return list(self._lists.get(key, ()))
+
+    def __contains__(self, key):
+        return key in self._lists
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def items(self):
+        """Return every (key, value) pair, in order."""
+        return list(self._items)
+
+    def to_dict(self):
+        """Return a dict with the first value for each key."""
+        return dict((key, values[0]) for key, values in self._lists.items())
+
+    def __repr__(self):
+        return 'MultiDict({0!r})'.format(self._items)
 
 
 def parse_cookies(header):
@@ -158,14 +351,41 @@ def dump_cookie(key, value, **kwargs):
     return cookie
 
 
+# Marks a cached field that hasn't been computed yet
+_unset = object()
+
+
 class Request(object):
 
-    """WSGI request wrapper."""
+    """WSGI request wrapper.
+
+    Fields derived from the environ, like url and cookies, are computed
+    on first access and kept. The framework's own attributes live in
+    __slots__; others, like a user set by a before_request hook, go in a
+    __dict__ that's only made when one is set. To change how requests
+    behave, subclass Request and set Malt.request_class.
+    """
+
+    __slots__ = ('environ', 'config', 'session', 'timer', 'view', 'charset',
+                 '_headers', '_host', '_url', '_cookies', '_content_length',
+                 '_data', '_body', '_remaining', '_received', '_form',
+                 '_files', '_args', '_json', 'json_backend', '__dict__')
 
     def __init__(self, environ, config):
         self.environ = environ
         self.config = config
-        self.headers = EnvironHeaders(environ)
+        self.charset = 'utf-8'
+        # Set to a malt.timing.Timer when the app is timing requests
+        self.timer = None
+        # The view function the request was routed to
+        self.view = None
+        # Set from Malt.json_backend; see malt.jsonlib
+        self.json_backend = None
+        self._headers = self._data = self._body = None
+        self._form = self._files = self._args = None
+        self._host = self._url = self._cookies = _unset
+        self._content_length = self._remaining = self._json = _unset
+        self._received = 0
 
     def environ_property(key):
         @property
@@ -173,8 +393,6 @@ class Request(object):
             return self.environ.get(key)
         return get_property
 
-    charset = 'utf-8'
-
     method = environ_property('REQUEST_METHOD')
     path = environ_property('PATH_INFO')
     script_name = environ_property('SCRIPT_NAME')
@@ -186,47 +404,247 @@ class Request(object):
     stream = environ_property('wsgi.input')
     del environ_property
 
+    @property
+    def headers(self):
+        if self._headers is None:
+            self._headers = EnvironHeaders(self.environ)
+        return self._headers
+
     @property
     def host(self):
-        return self.headers.get('Host', self.environ.get('SERVER_NAME'))
+        if self._host is _unset:
+            self._host = self.headers.get('Host',
+                                          self.environ.get('SERVER_NAME'))
+        return self._host
+
+    @property
+    def content_length(self):
+        """The Content-Length as an int, or None if missing or invalid."""
+        if self._content_length is _unset:
+            try:
+                self._content_length = int(self.environ['CONTENT_LENGTH'])
+            except (KeyError, ValueError):
+                self._content_length = None
+        return self._content_length
+
+    def _allow(self, size):
+        """Return how much of size can be read from the stream.
+
+        Raise a 413 if the body is larger than config['MAX_CONTENT_LENGTH'].
+        """
+        remaining = self._remaining
+        if remaining is _unset:
+            length = self.content_length
+            max_length = self.config.get('MAX_CONTENT_LENGTH')
+            if length is not None:
+                if max_length is not None and length > max_length:
+                    raise HTTPException(413)
+                remaining = length
+            elif self.environ.get('wsgi.input_terminated'):
+                # A chunked body, that the server ends with EOF
+                remaining = None
+            else:
+                remaining = 0
+            self._remaining = remaining
+        if remaining is None:
+            return size
+        return min(size, remaining)
+
+    def _consumed(self, size):
+        if self._remaining is not None:
+            self._remaining -= size
+        else:
+            self._received += size
+            max_length = self.config.get('MAX_CONTENT_LENGTH')
+            if max_length is not None and self._received > max_length:
+                raise HTTPException(413)
+
+    def iter_chunks(self, size=65536):
+        """Yield the body in chunks of at most size bytes."""
+        if self._data is not None or self._body is not None:
+            # Already read by data() or body()
+            body = self.body()
+            body.seek(0)
+            for chunk in iter(lambda: body.read(size), b''):
+                yield chunk
+            body.seek(0)
+            return
+        while True:
+            allowed = self._allow(size)
+            if allowed <= 0:
+                return
+            chunk = self.stream.read(allowed)
+            if not chunk:
+                return
+            self._consumed(len(chunk))
+            yield chunk
+
+    def readinto(self, buffer):
+        """Read the body into buffer. Return the size read, or 0 at the end.
+
+        Reuse one buffer across calls to read a large body without
+        allocating a new bytes object per chunk.
+        """
+        view = memoryview(buffer)
+        size = self._allow(len(view))
+        if size <= 0:
+            return 0
+        readinto = getattr(self.stream, 'readinto', None)
+        if readinto is not None:
+            read = readinto(view[:size]) or 0
+        else:
+            chunk = self.stream.read(size)
+            read = len(chunk)
+            view[:read] = chunk
+        self._consumed(read)
+        return read
+
+    def body(self):
+        """Return the body as a seekable file.
+
+        Bodies larger than config['BODY_SPOOL_SIZE'] (1 MiB by default) are
+        spooled to a temporary file, instead of being kept in memory.
+        """
+        if self._body is None:
+            if self._data is not None:
+                self._body = BytesIO(self._data)
+            else:
+                body = SpooledTemporaryFile(
+                    self.config.get('BODY_SPOOL_SIZE', 1024 * 1024))
+                for chunk in self.iter_chunks():
+                    body.write(chunk)
+                body.seek(0)
+                self._body = body
+        return self._body
 
     def data(self):
-        if getattr(self, '_data', None) is None:
-            content_length = self.headers.get('Content-Length', '0')
+        if self._data is None:
+            if self._body is not None:
+                self._body.seek(0)
+                self._data = self._body.read()
+                self._body.seek(0)
+            else:
+                self._data = b''.join(
+                    self.iter_chunks(self.content_length or 65536))
+        return self._data
+
+    def iter_parts(self):
+        """Yield the parts of a multipart body one at a time.
+
+        Each part is a malt.multipart.Part; iterate over it for its data.
+        Use this instead of form and files to handle large uploads as they
+        arrive. config['MAX_FORM_PARTS'] (1000 by default) limits the
+        number of parts, and config['MAX_PART_SIZE'] their size.
+        """
+        mimetype, params = parse_options_header(
+            self.headers.get('Content-Type', ''))
+        if not mimetype.startswith('multipart/'):
+            raise HTTPException(400, 'Not a multipart body')
+        boundary = want_bytes(params.get('boundary', ''), 'latin1')
+        return iter(MultipartParser(
+            self.iter_chunks(), boundary,
+            max_parts=self.config.get('MAX_FORM_PARTS', 1000),
+            max_part_size=self.config.get('MAX_PART_SIZE')))
+
+    @property
+    def args(self):
+        """The query string arguments, as a MultiDict.
+
+        More than config['MAX_FORM_PARAMS'] (1000 by default) of them is a
+        400 error.
+        """
+        if self._args is None:
             try:
-                size = int(content_length)
+                args = parse_qsl(self.query_string, self.charset,
+                                 self.config.get('MAX_FORM_PARAMS', 1000))
             except ValueError:
-                size = 0
-            self._data = self.stream.read(size)
-        return self._data
+                raise HTTPException(400, 'Too many query parameters')
+            self._args = MultiDict(args)
+        return self._args
+
+    def _load_form(self):
+        form = files = ()
+        mimetype = self.headers.get('Content-Type', '').partition(';')[0]
+        mimetype = mimetype.strip().lower()
+        if mimetype == 'multipart/form-data':
+            form, files = parse_form(
+                self.iter_parts(), self.charset,
+                self.config.get('BODY_SPOOL_SIZE', 1024 * 1024))
+        elif mimetype == 'application/x-www-form-urlencoded':
+            try:
+                form = parse_qsl(want_text(self.data(), 'latin1'),
+                                 self.charset,
+                                 self.config.get('MAX_FORM_PARAMS', 1000))
+            except ValueError:
+                raise HTTPException(413)
+        self._form = MultiDict(form)
+        self._files = MultiDict(files)
+
+    @property
+    def form(self):
+        """The fields of a form body, as a MultiDict.
+
+        Both application/x-www-form-urlencoded and multipart/form-data
+        bodies are parsed. A urlencoded body with more than
+        config['MAX_FORM_PARAMS'] fields is a 413 error.
+        """
+        if self._form is None:
+            self._load_form()
+        return self._form
+
+    @property
+    def files(self):
+        """The files of a multipart/form-data body, as a MultiDict.
+
+        The values are malt.multipart.FileStorage objects. Files larger
+        than config['BODY_SPOOL_SIZE'] are spooled to disk.
+        """
+        if self._files is None:
+            self._load_form()
+        return self._files
 
     def json(self):
-        content_type = self.headers.get('Content-Type', '')
-        prefix = 'application/json; charset='
-        if content_type.startswith(prefix):
-            self.charset = content_type[len(prefix):]
-        try:
-            return json.loads(self.data().decode(self.charset))
-        except ValueError:
-            raise HTTPException(400)
+        """Decode the body as JSON, once.
+
+        UTF-8 bodies go to the parser as bytes, from json_backend.
+        """
+        if self._json is _unset:
+            _, params = parse_options_header(
+                self.headers.get('Content-Type', ''))
+            data = self.data()
+            if 'charset' in params:
+                self.charset = params['charset']
+                if self.charset.lower() not in ('utf-8', 'utf8'):
+                    try:
+                        data = data.decode(self.charset)
+                    except (LookupError, ValueError):
+                        raise HTTPException(400)
+            backend = get_backend(self.json_backend)
+            try:
+                self._json = backend.loads(data)
+            except ValueError:
+                raise HTTPException(400)
+        return self._json
 
     @property
     def url(self):
-        url = self.scheme + '://'
-        if self.headers.get('Host'):
-            url += self.headers.get('Host')
-        else:
-            url += self.host
-            if self.port != ('80' if self.scheme == 'http' else '443'):
-                url += ':' + self.port
-        url += self.script_name + self.path
-        if self.query_string:
-            url += '?' + self.query_string
-        return url
+        if self._url is _unset:
+            url = self.scheme + '://'
+            if self.headers.get('Host'):
+                url += self.headers.get('Host')
+            else:
+                url += self.host
+                if self.port != ('80' if self.scheme == 'http' else '443'):
+                    url += ':' + self.port
+            url += self.script_name + self.path
+            if self.query_string:
+                url += '?' + self.query_string
+            self._url = url
+        return self._url
 
     @property
     def cookies(self):
-        if not hasattr(self, '_cookies'):
+        if self._cookies is _unset:
             self._cookies = parse_cookies(self.headers.get('Cookie', ''))
         return self._cookies
 
@@ -235,6 +653,13 @@ class Response(object):
 
     """WSGI response object."""
 
+    # Chunks of a streamed body, like a generator, are sent as soon as
+    # they're made. Set this to join small ones into writes of about this
+    # many bytes. List bodies are ready to send, so they're always joined,
+    # into writes of LIST_BUFFER_SIZE bytes unless this is set
+    buffer_size = 0
+    LIST_BUFFER_SIZE = 16384
+
     def __init__(self, data='', code=200, mimetype=MIME_PLAIN,
                  charset='utf-8'):
         if isinstance(data, (bytes, type(u''))):
@@ -259,9 +684,206 @@ class Response(object):
     status_code = property(_get_status_code, _set_status_code)
     del _get_status_code, _set_status_code
 
+    def prepare(self, environ):
+        """Finish the response, just before start_response is called.
+
+        A list body is encoded up front, and Content-Length is set from
+        it, so that the connection can be kept alive. Return the iterable
+        to hand to the server.
+        """
+        if not isinstance(self.response, (list, tuple)) or \
+                'Content-Length' in self.headers:
+            return self
+        code = self.status_code
+        if code < 200 or code in (204, 304):
+            return self
+        charset = self.charset
+        body = [chunk if chunk.__class__ is bytes else
+                want_bytes(chunk, charset=charset) for chunk in self.response]
+        self.response = body
+        self.headers['Content-Length'] = str(sum(len(chunk) for chunk in body))
+        return self
+
     def __iter__(self):
+        charset = self.charset
+        buffer_size = self.buffer_size
+        if not buffer_size and isinstance(self.response, (list, tuple)):
+            buffer_size = self.LIST_BUFFER_SIZE
+        batch = []
+        size = 0
         for chunk in self.response:
-            yield want_bytes(chunk, charset=self.charset)
+            if chunk.__class__ is not bytes:
+                chunk = want_bytes(chunk, charset=charset)
+            batch.append(chunk)
+            size += len(chunk)
+            if size >= buffer_size:
+                yield batch[0] if len(batch) == 1 else b''.join(batch)
+                batch = []
+                size = 0
+        if batch:
+            yield b''.join(batch)
+
+    def close(self):
+        """Close the body, if it can be; WSGI servers call this."""
+        close = getattr(self.response, 'close', None)
+        if close is not None:
+            close()
 
     def set_cookie(self, key, value=None, **kwargs):
         self.headers.add('Set-Cookie', dump_cookie(key, value, **kwargs))
+
+
+_RANGE = re.compile(r'\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def parse_range(header, size, max_ranges=16):
+    """Parse a Range header, for a resource of size bytes.
+
+    Return a list of (start, end) pairs, with end exclusive, or an empty
+    list if no range can be satisfied. Return None if the header is
+    invalid or asks for more than max_ranges ranges, in which case it
+    should be ignored.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for part in spec.split(','):
+        m = _RANGE.match(part)
+        if m is None:
+            return None
+        first, last = m.groups()
+        if first:
+            start = int(first)
+            if last:
+                if int(last) < start:
+                    return None
+                end = int(last) + 1
+            else:
+                end = size
+            if start < size:
+                ranges.append((start, min(end, size)))
+        elif last:
+            # The last n bytes
+            count = int(last)
+            if count:
+                ranges.append((max(size - count, 0), size))
+        else:
+            return None
+    if len(ranges) > max_ranges:
+        return None
+    return ranges
+
+
+class FileResponse(Response):
+
+    """Serve a file, given as a path or a file object opened in binary mode.
+
+    Range requests get a 206, with a multipart/byteranges body for more
+    than one range, or a 416 if none of the ranges can be satisfied.
+    Whole files are handed to the server's wsgi.file_wrapper when it has
+    one, and malt.server sends them with sendfile. The file is closed with
+    the response.
+    """
+
+    def __init__(self, file, mimetype=None, code=200, chunk_size=65536):
+        if is_string(file):
+            if mimetype is None:
+                mimetype = mimetypes.guess_type(file)[0]
+            file = open(file, 'rb')
+        super(FileResponse, self).__init__(
+            code=code, mimetype=mimetype or 'application/octet-stream')
+        self.file = file
+        self.chunk_size = chunk_size
+        try:
+            self.size = os.fstat(file.fileno()).st_size
+        except (AttributeError, OSError, ValueError):
+            file.seek(0, 2)
+            self.size = file.tell()
+        # The body: literal bytes, and (offset, count) spans of the file
+        self.segments = [(0, self.size)] if self.size else []
+        self.response = None
+
+    def _range_matches(self, environ):
+        """Check If-Range against the ETag or Last-Modified we send."""
+        if_range = environ.get('HTTP_IF_RANGE')
+        if if_range is None:
+            return True
+        return if_range.strip() in (self.headers.get('ETag'),
+                                    self.headers.get('Last-Modified'))
+
+    def prepare(self, environ):
+        if self.status_code != 200:
+            self.headers['Content-Length'] = str(self.size)
+            return self
+        self.headers['Accept-Ranges'] = 'bytes'
+        header = environ.get('HTTP_RANGE')
+        ranges = None
+        if header and environ.get('REQUEST_METHOD') in ('GET', 'HEAD') and \
+                self._range_matches(environ):
+            ranges = parse_range(header, self.size)
+
+        if ranges is None:
+            self.headers['Content-Length'] = str(self.size)
+            wrapper = environ.get('wsgi.file_wrapper')
+            if wrapper is not None and self.size:
+                self.file.seek(0)
+                self.response = wrapper(self.file, self.chunk_size)
+                return self.response
+            return self
+        if not ranges:
+            self.status_code = 416
+            self.headers['Content-Range'] = 'bytes */{0:d}'.format(self.size)
+            self.headers['Content-Length'] = '0'
+            self.segments = []
+            return self
+
+        self.status_code = 206
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            self.headers['Content-Range'] = 'bytes {0:d}-{1:d}/{2:d}'.format(
+                start, end - 1, self.size)
+            self.segments = [(start, end - start)]
+        else:
+            boundary = uuid.uuid4().hex
+            mimetype = self.headers['Content-Type']
+            self.headers['Content-Type'] = \
+                'multipart/byteranges; boundary=' + boundary
+            self.segments = []
+            for start, end in ranges:
+                self.segments.append(want_bytes(
+                    '\r\n--{0}\r\nContent-Type: {1}\r\n'
+                    'Content-Range: bytes {2:d}-{3:d}/{4:d}\r\n\r\n'.format(
+                        boundary, mimetype, start, end - 1, self.size),
+                    'latin1'))
+                self.segments.append((start, end - start))
+            self.segments.append(want_bytes(
+                '\r\n--{0}--\r\n'.format(boundary), 'latin1'))
+        self.headers['Content-Length'] = str(sum(
+            len(segment) if segment.__class__ is bytes else segment[1]
+            for segment in self.segments))
+        return self
+
+    def __iter__(self):
+        if self.response is not None:
+            # Handed to wsgi.file_wrapper already
+            for chunk in self.response:
+                yield chunk
+            return
+        read = self.file.read
+        for segment in self.segments:
+            if segment.__class__ is bytes:
+                yield segment
+                continue
+            offset, count = segment
+            self.file.seek(offset)
+            while count > 0:
+                chunk = read(min(count, self.chunk_size))
+                if not chunk:
+                    break
+                count -= len(chunk)
+                yield chunk
+
+    def close(self):
+        super(FileResponse, self).close()
+        self.file.close()
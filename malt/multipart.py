@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""Streaming multipart/form-data parsing.
+
+The body is read in chunks, and each part's data is found by searching
+a small buffer for the boundary, so memory use doesn't grow with the
+size of the upload. Files larger than the spool size go to a temporary
+file on disk.
+
+Request.form and Request.files use parse_form(). To handle one part at a
+time instead, iterate over Request.iter_parts(), and over each part for
+its data.
+"""
+
+from .exceptions import HTTPException
+from .helpers import unquote, want_text
+from tempfile import SpooledTemporaryFile
+import re
+import shutil
+
+_PARAM = re.compile(r';\s*([^\s=;]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+
+
+def parse_options_header(value):
+    """Split a header like Content-Type into its value and parameters.
+
+    >>> parse_options_header('form-data; name="a"; filename="b.txt"')
+    ('form-data', {'name': 'a', 'filename': 'b.txt'})
+    """
+    main, _, rest = value.partition(';')
+    params = {}
+    for key, param in _PARAM.findall(';' + rest):
+        key = key.lower()
+        param = param.strip()
+        if param.startswith('"'):
+            param = re.sub(r'\\(.)', r'\1', param[1:-1])
+        elif key.endswith('*') and "''" in param:
+            # RFC 5987, like filename*=UTF-8''na%C3%AFve.txt
+            charset, _, param = param.partition("''")
+            key = key[:-1]
+            try:
+                param = unquote(param, charset or 'utf-8')
+            except LookupError:
+                continue
+        params[key] = param
+    return main.strip().lower(), params
+
+
+class Part(object):
+
+    """One part of a multipart body, as it's being read.
+
+    Iterate over a part to get its data in chunks. Whatever isn't read
+    is skipped when the parser moves on to the next part.
+    """
+
+    def __init__(self, headers, chunks):
+        self.headers = headers
+        disposition, params = parse_options_header(
+            headers.get('content-disposition', ''))
+        self.name = params.get('name')
+        self.filename = params.get('filename')
+        self.content_type = headers.get('content-type')
+        self._chunks = chunks
+
+    def __iter__(self):
+        return self._chunks
+
+    def read(self):
+        """Return the rest of the part's data."""
+        return b''.join(self._chunks)
+
+
+class FileStorage(object):
+
+    """An uploaded file, spooled to disk if it's large."""
+
+    def __init__(self, name, filename, content_type, headers, stream, size):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.headers = headers
+        self.stream = stream
+        self.size = size
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def save(self, destination):
+        """Copy the file to destination, a path or a file object."""
+        self.stream.seek(0)
+        if hasattr(destination, 'write'):
+            shutil.copyfileobj(self.stream, destination)
+        else:
+            with open(destination, 'wb') as f:
+                shutil.copyfileobj(self.stream, f)
+
+    def close(self):
+        self.stream.close()
+
+    def __repr__(self):
+        return '<FileStorage {0!r} ({1!r})>'.format(
+            self.filename, self.content_type)
+
+
+class MultipartParser(object):
+
+    """Split a multipart body, given as an iterable of chunks, into parts.
+
+    The parser raises HTTPException(413) once there are more than
+    max_parts parts, a part is larger than max_part_size, or its headers
+    are larger than max_header_size, and HTTPException(400) for a
+    malformed body.
+    """
+
+    def __init__(self, chunks, boundary, max_parts=1000, max_part_size=None,
+                 max_header_size=8192):
+        if not boundary or len(boundary) > 200:
+            raise HTTPException(400)
+        self._chunks = iter(chunks)
+        # The first boundary may come without a CRLF before it
+        self._buffer = bytearray(b'\r\n')
+        self._delimiter = b'\r\n--' + boundary
+        self.max_parts = max_parts
+        self.max_part_size = max_part_size
+        self.max_header_size = max_header_size
+
+    def _fill(self):
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer += chunk
+                return
+        raise HTTPException(400, 'Incomplete multipart body')
+
+    def _data(self, limit):
+        """Yield data up to the next delimiter, and consume it."""
+        buf = self._buffer
+        delimiter = self._delimiter
+        # A delimiter split between reads starts in the last bytes
+        keep = len(delimiter) - 1
+        size = 0
+        while True:
+            i = buf.find(delimiter)
+            if i >= 0:
+                chunk = bytes(buf[:i])
+                del buf[:i + len(delimiter)]
+            elif len(buf) > keep:
+                chunk = bytes(buf[:-keep])
+                del buf[:-keep]
+            else:
+                chunk = b''
+            size += len(chunk)
+            if limit is not None and size > limit:
+                raise HTTPException(413)
+            if chunk:
+                yield chunk
+            if i >= 0:
+                return
+            self._fill()
+
+    def _headers(self):
+        buf = self._buffer
+        while True:
+            if buf.startswith(b'\r\n'):
+                # No headers at all
+                del buf[:2]
+                return {}
+            i = buf.find(b'\r\n\r\n')
+            if i >= 0:
+                break
+            if len(buf) > self.max_header_size:
+                raise HTTPException(413)
+            self._fill()
+        raw = bytes(buf[:i])
+        del buf[:i + 4]
+        headers = {}
+        for line in raw.split(b'\r\n'):
+            name, sep, value = line.partition(b':')
+            if not sep:
+                raise HTTPException(400)
+            name = want_text(name, 'latin1').strip().lower()
+            # Browsers send non-ASCII file names as raw UTF-8
+            headers[name] = want_text(value, 'utf-8', 'replace').strip()
+        return headers
+
+    def __iter__(self):
+        """Yield a Part for each part of the body, in order."""
+        # Skip the preamble
+        for _ in self._data(None):
+            pass
+        count = 0
+        part = None
+        while True:
+            if part is not None:
+                for _ in part._chunks:
+                    pass
+            buf = self._buffer
+            while len(buf) < 2:
+                self._fill()
+            if buf.startswith(b'--'):
+                return
+            if not buf.startswith(b'\r\n'):
+                raise HTTPException(400)
+            del buf[:2]
+            count += 1
+            if count > self.max_parts:
+                raise HTTPException(413)
+            headers = self._headers()
+            part = Part(headers, self._data(self.max_part_size))
+            yield part
+
+
+def parse_form(parser, charset='utf-8', spool_size=1024 * 1024):
+    """Read every part, and return lists of (name, value) pairs.
+
+    The first list has the text fields, decoded using charset. Fields
+    are kept in memory, so one larger than spool_size raises a 413. The
+    second list has the files, as FileStorage objects.
+    """
+    form = []
+    files = []
+    for part in parser:
+        if part.filename is None:
+            data = bytearray()
+            for chunk in part:
+                data += chunk
+                if len(data) > spool_size:
+                    raise HTTPException(413)
+            form.append((part.name, want_text(bytes(data), charset,
+                                              'replace')))
+        else:
+            stream = SpooledTemporaryFile(spool_size)
+            size = 0
+            for chunk in part:
+                stream.write(chunk)
+                size += len(chunk)
+            stream.seek(0)
+            files.append((part.name, FileStorage(
+                part.name, part.filename, part.content_type, part.headers,
+                stream, size)))
+    return form, files
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Sampling profiler for production traffic.
+
+A Sampler runs cProfile on one request in every N, and on every request
+whose path matches one of the given patterns. Profiles go in a bounded
+ring buffer, and can be aggregated per route into pstats.Stats objects.
+
+When a slow threshold is set, sampled requests slower than it go in a
+ring of their own, so that fast samples don't push them out. An unsampled
+request slower than the threshold gets the next request to the same path
+profiled.
+"""
+
+from .metrics import UNMATCHED
+from .timing import monotonic
+from collections import deque
+import cProfile
+import os
+import pstats
+import re
+import threading
+
+
+class Sampler(object):
+
+    """Profile a sample of requests."""
+
+    def __init__(self, router, every=100, paths=(), slow=None, capacity=50):
+        self.router = router
+        self.every = every
+        self.paths = [re.compile(path) for path in paths]
+        self.slow = slow
+        self.profiles = deque(maxlen=capacity)
+        self.slow_profiles = deque(maxlen=capacity)
+        self._count = 0
+        self._armed = set()
+        self._capacity = capacity
+        # cProfile can only run one profiler at a time
+        self._busy = threading.Lock()
+
+    def should_sample(self, request):
+        self._count += 1
+        if self.every and self._count % self.every == 0:
+            return True
+        if self._armed and request.path in self._armed:
+            self._armed.discard(request.path)
+            return True
+        for path in self.paths:
+            if path.match(request.path):
+                return True
+        return False
+
+    def run(self, dispatch, request):
+        """Call dispatch(request), profiling it if it's sampled."""
+        sample = self.should_sample(request) and self._busy.acquire(False)
+        started = monotonic()
+        if not sample:
+            response = dispatch(request)
+            if self.slow is not None and monotonic() - started >= self.slow \
+                    and len(self._armed) < self._capacity:
+                self._armed.add(request.path)
+            return response
+
+        profile = cProfile.Profile()
+        try:
+            response = profile.runcall(dispatch, request)
+        finally:
+            self._busy.release()
+        duration = monotonic() - started
+        route = UNMATCHED
+        if request.view is not None:
+            route = self.router.path_for(request.view)
+        if self.slow is not None and duration >= self.slow:
+            self.slow_profiles.append((route, duration, profile))
+        else:
+            self.profiles.append((route, duration, profile))
+        return response
+
+    def stats(self):
+        """Aggregate the kept profiles, as {route: pstats.Stats}."""
+        stats = {}
+        for route, _, profile in list(self.profiles) + \
+                list(self.slow_profiles):
+            if route in stats:
+                stats[route].add(profile)
+            else:
+                stats[route] = pstats.Stats(profile)
+        return stats
+
+    def dump_stats(self, directory):
+        """Write the aggregated profile of each route to directory.
+
+        Return the {route: filename} written.
+        """
+        filenames = {}
+        for route, stats in self.stats().items():
+            name = re.sub(r'[^\w.-]+', '_', route).strip('_') or 'root'
+            filename = os.path.join(directory, name + '.pstats')
+            stats.dump_stats(filename)
+            filenames[route] = filename
+        return filenames
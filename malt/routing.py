@@ -2,17 +2,381 @@
 """The URL routing.
 
 This module implements regex-based URL view matching.
+
+Rules are compiled into a dispatch table the first time a path is looked
+up after a rule was added. Fully literal patterns like '^/tasks$' go in a
+plain dict keyed by path. The other patterns are bucketed by their literal
+first path segment, and each bucket is matched by a few combined
+alternation regexes, so lookups only try the rules that could possibly
+match.
+
+Patterns may contain typed placeholders, like '^/tasks/<int>$'. Each one
+becomes a capturing group with a tight regex, and its value is converted
+before the view gets it. A value that fails to convert makes the rule
+not match.
+
+URLs are built from the same patterns. Each view's pattern is compiled
+into a format string when it's registered, with one slot per group.
+
+Optionally, a bounded LRU cache keyed on (method, path) sits in front of
+the dispatch table, for apps where a few concrete URLs get most traffic.
+
+Prefix mounts, like the one for static files, are checked before any of
+the rules, with a plain startswith() test.
 """
+from .helpers import text_type, want_bytes
+from collections import namedtuple, OrderedDict
 import re
+import sys
+import threading
+import uuid
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+
+# Python < 3.5 refuses to compile patterns with 100 or more groups
+_MAX_GROUPS = 99 if sys.version_info < (3, 5) else 10000
+_DEFAULT_FLAGS = re.compile('').flags
+_BACKREFS = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+_SPECIAL = frozenset('.^$*+?{}[]|()\\')
+_QUANTIFIERS = frozenset('*+?{')
+_PLACEHOLDER = re.compile(r'(?<!\(\?P)<(\w+)>')
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class Converter(object):
+
+    """A typed placeholder: the regex it matches, and how to convert it."""
+
+    regex = '[^/]+'
+
+    def to_python(self, value):
+        return value
+
+    def to_url(self, value):
+        if not isinstance(value, (bytes, text_type)):
+            value = text_type(value)
+        return quote(want_bytes(value), safe='')
+
+
+class IntConverter(Converter):
+
+    """Match a non-negative integer."""
+
+    regex = r'\d+'
+
+    def to_python(self, value):
+        return int(value)
+
+    def to_url(self, value):
+        return '{0:d}'.format(int(value))
+
+
+class UUIDConverter(Converter):
+
+    """Match a UUID, in the usual hyphenated form."""
+
+    regex = ('[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-'
+             '[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+    def to_python(self, value):
+        return uuid.UUID(value)
+
+
+class SlugConverter(Converter):
+
+    """Match a single segment of letters, digits, dashes and underscores."""
+
+    regex = '[-A-Za-z0-9_]+'
+
+
+class PathConverter(Converter):
+
+    """Match the rest of the path, slashes included."""
+
+    regex = '.+'
+
+    def to_url(self, value):
+        return quote(want_bytes(value), safe='/')
+
+
+DEFAULT_CONVERTERS = {
+    'int': IntConverter(),
+    'uuid': UUIDConverter(),
+    'slug': SlugConverter(),
+    'path': PathConverter(),
+}
+
+
+def _translate(path, converters):
+    """Replace placeholders in path with groups.
+
+    Return the new pattern, and a tuple with the converter for each group
+    of the pattern (None for plain groups), or None if there aren't any
+    placeholders.
+    """
+    found = []
+
+    def group(m):
+        converter = converters.get(m.group(1))
+        if converter is None:
+            return m.group(0)
+        found.append(converter)
+        # Name the group for now, to find out its number
+        return '(?P<_malt{0:d}>{1})'.format(len(found) - 1, converter.regex)
+
+    named = _PLACEHOLDER.sub(group, path)
+    if not found:
+        return path, None
+
+    reg = re.compile(named)
+    converted = [None] * reg.groups
+    for i, converter in enumerate(found):
+        converted[reg.groupindex['_malt{0:d}'.format(i)] - 1] = converter
+    return re.sub(r'\(\?P<_malt\d+>', '(', named), tuple(converted)
+
+
+def _convert(converters, args):
+    return tuple(value if conv is None or value is None
+                 else conv.to_python(value)
+                 for conv, value in zip(converters, args))
+
+
+def _group_end(pattern, i):
+    """Return the index just past the group starting at pattern[i].
+
+    Return None if the group contains capturing groups of its own.
+    """
+    depth = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '[':
+            # Skip the character class; ']' right after '[' or '[^' is
+            # a literal
+            i += 2 if pattern[i + 1:i + 2] == '^' else 1
+            i = pattern.index(']', i + 1) + 1
+            continue
+        if c == '(':
+            if depth > 0 and pattern[i + 1:i + 2] != '?':
+                return None
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return None
+
+
+def _alternates(pattern):
+    """Whether pattern has a '|' outside of any group."""
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '[':
+            i += 2 if pattern[i + 1:i + 2] == '^' else 1
+            i = pattern.index(']', i + 1) + 1
+            continue
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return True
+        i += 1
+    return False
+
+
+def _template(path, converters):
+    """Compile a pattern into a (format string, slot converters) pair.
+
+    Return None if the pattern can't be reversed, e.g. if it uses
+    alternation or quantifiers outside of groups.
+    """
+    default = Converter()
+    parts = []
+    slots = []
+    i = 1 if path.startswith('^') else 0
+    while i < len(path):
+        c = path[i]
+        end = None
+        if c == '\\':
+            if path[i + 1:i + 2].isalnum():
+                if path[i:] == r'\Z':
+                    break
+                return None
+            parts.append(path[i + 1:i + 2])
+            end = i + 2
+        elif c == '<':
+            m = _PLACEHOLDER.match(path, i)
+            if m is not None and m.group(1) in converters:
+                slots.append(converters[m.group(1)])
+                end = m.end()
+        elif c == '(':
+            capturing = path[i + 1:i + 2] != '?' or \
+                path[i + 1:i + 3] == '?P' and path[i + 3:i + 4] == '<'
+            end = _group_end(path, i)
+            if end is None or not capturing:
+                return None
+            slots.append(default)
+        elif c == '$' and i + 1 == len(path):
+            break
+        elif c not in _SPECIAL:
+            parts.append(c)
+            end = i + 1
+        if end is None or path[end:end + 1] in _QUANTIFIERS:
+            return None
+        if c in '<(':
+            parts.append('{{{0:d}}}'.format(len(slots) - 1))
+        else:
+            parts[-1] = parts[-1].replace('{', '{{').replace('}', '}}')
+        i = end
+    fmt = ''.join(parts)
+    if not slots:
+        # Static URLs are built once, here
+        fmt = fmt.format()
+    return fmt, tuple(slots)
+
+
+def _literal_prefix(pattern):
+    """Split a pattern into its leading literal text and the remainder.
+
+    For example, '^/things/(\\d+)$' splits into '/things/' and '(\\d+)$'.
+    """
+    i = 1 if pattern.startswith('^') else 0
+    prefix = []
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            if i + 1 == len(pattern) or pattern[i + 1].isalnum():
+                break
+            step, c = 2, pattern[i + 1]
+        elif c in _SPECIAL:
+            break
+        else:
+            step = 1
+        # A quantified character isn't part of the literal prefix
+        if pattern[i + step:i + step + 1] in _QUANTIFIERS:
+            break
+        prefix.append(c)
+        i += step
+    return ''.join(prefix), pattern[i:]
+
+
+def _literal_path(reg):
+    """Return the only path reg can match, or None if it's dynamic."""
+    if reg.flags != _DEFAULT_FLAGS:
+        return None
+    prefix, rest = _literal_prefix(reg.pattern)
+    if rest in ('$', r'\Z'):
+        return prefix
+    return None
+
+
+def _segment_for(reg):
+    """Return the first path segment every match of reg must have.
+
+    None means the pattern could match paths with any first segment.
+    """
+    if reg.flags != _DEFAULT_FLAGS or _alternates(reg.pattern):
+        return None
+    prefix, rest = _literal_prefix(reg.pattern)
+    if not prefix.startswith('/'):
+        return None
+    end = prefix.find('/', 1)
+    if end != -1:
+        return prefix[1:end]
+    return None
+
+
+def _path_segment(path):
+    """Return the first segment of a path, the bucket key for lookups."""
+    end = path.find('/', 1)
+    if end == -1:
+        return path[1:]
+    return path[1:end]
+
+
+def _combinable(reg):
+    """Whether a pattern is safe to embed in a larger alternation."""
+    return (reg.flags == _DEFAULT_FLAGS and not reg.groupindex and
+            _BACKREFS.search(reg.pattern) is None)
+
+
+def _compile_chunks(entries):
+    """Compile (reg, target) pairs into a list of matchers, keeping order.
+
+    Each matcher is a (match, slots, target) triple. Runs of combinable
+    patterns are joined into one alternation where every pattern is
+    wrapped in its own group; the group that closed last identifies the
+    pattern that matched, and slots maps it to the target and group count.
+    Other patterns get a matcher of their own, with slots set to None.
+    """
+    chunks = []
+    run = []
+
+    def flush():
+        if len(run) == 1:
+            reg, target = run[0]
+            chunks.append((reg.match, None, target))
+        elif run:
+            slots = {}
+            parts = []
+            index = 0
+            for reg, target in run:
+                slots[index + 1] = index + 1, reg.groups, target
+                parts.append('(' + reg.pattern + ')')
+                index += reg.groups + 1
+            chunks.append((re.compile('|'.join(parts)).match, slots, None))
+        del run[:]
+
+    groups = 0
+    for reg, target in entries:
+        if not _combinable(reg):
+            flush()
+            chunks.append((reg.match, None, target))
+            groups = 0
+            continue
+        if groups + reg.groups + 1 > _MAX_GROUPS:
+            flush()
+            groups = 0
+        run.append((reg, target))
+        groups += reg.groups + 1
+    flush()
+    return chunks
 
 
 class Router(object):
 
-    """Connect view functions to URL rules."""
+    """Connect view functions to URL rules.
+
+    Set cache_size to a positive number to cache that many lookups.
+    """
 
-    def __init__(self):
+    def __init__(self, cache_size=0):
         self.path_map = {}
         self.view_map = {}
+        self.cache_size = cache_size
+        self.converters = dict(DEFAULT_CONVERTERS)
+        self._rules = []
+        self._targets = {}
+        self._mounts = []
+        self._templates = {}
+        self._compiled = None
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._hits = self._misses = 0
+        self.frozen = False
 
     def add_rule(self, method, path, view):
         """Store the view and rule relation in the two lookup maps.
@@ -20,28 +384,215 @@ class Router(object):
         The view gets stored under the path and method in the path_map
         matrix. The path/method rule is stored under view in view_map.
         """
-        reg = re.compile(path)
-        self.path_map.setdefault(reg, {})
+        if self.frozen:
+            raise RuntimeError('Rules cannot be added to a frozen router')
+        pattern, converters = _translate(path, self.converters)
+        reg = re.compile(pattern)
+        if reg not in self.path_map:
+            self.path_map[reg] = {}
+            # The rule, its converters, position, and Allow header value
+            target = [self.path_map[reg], converters, len(self._rules), '']
+            self._rules.append((reg, target))
+            self._targets[reg] = target
+        else:
+            # Equal patterns aren't always the same object, once re's
+            # cache has dropped them
+            target = self._targets[reg]
 
         rule = self.path_map[reg]
         if method in rule:
             raise Exception('Duplicate route: {0} {1}'.format(method, path))
         rule[method] = view
+        target[3] = ', '.join(sorted(rule))
         if view not in self.view_map:
             self.view_map[view] = method, path
+            self._templates[view] = _template(path, self.converters)
+        self._compiled = None
+        self.cache_clear()
 
-    def get_view(self, method, path):
-        """Look up the view."""
-        for reg, rule in self.path_map.items():
+    def mount(self, prefix, view, methods=('GET', 'HEAD')):
+        """Route every path starting with prefix to view, before the rules.
+
+        The view is called with the rest of the path. Longer prefixes are
+        tried first.
+        """
+        if self.frozen:
+            raise RuntimeError('Rules cannot be added to a frozen router')
+        methods = frozenset(methods)
+        self._mounts.append((prefix, view, methods,
+                             ', '.join(sorted(methods))))
+        self._mounts.sort(key=lambda mount: -len(mount[0]))
+        if view not in self.view_map:
+            self.view_map[view] = 'GET', prefix
+            self._templates[view] = (
+                prefix.replace('{', '{{').replace('}', '}}') + '{0}',
+                (self.converters['path'],))
+        self.cache_clear()
+
+    def compile(self):
+        """Build the dispatch table for the current rules."""
+        literals = []
+        keyed = []
+        for reg, target in self._rules:
+            path = _literal_path(reg)
+            if path is not None:
+                literals.append((path, target))
+            else:
+                keyed.append((_segment_for(reg), (reg, target)))
+
+        buckets = {}
+        for key in set(k for k, _ in keyed if k is not None):
+            buckets[key] = _compile_chunks([entry for k, entry in keyed
+                                            if k is None or k == key])
+        wildcard = _compile_chunks([entry for k, entry in keyed if k is None])
+
+        # A literal rule only owns its path if no earlier rule matches it.
+        # Literal rules never match each other's paths, so only the dynamic
+        # rules need checking. The table is published once it's complete,
+        # so concurrent lookups never see it half built.
+        static = {}
+        for path, target in literals:
+            if path in static:
+                continue
+            shadow, _ = self._match(path, ({}, buckets, wildcard))
+            if shadow is None or shadow[2] >= target[2]:
+                static[path] = target
+        compiled = self._compiled = static, buckets, wildcard
+        return compiled
+
+    def _scan(self, path, start=0):
+        """Try each rule in order, without the dispatch table."""
+        for reg, target in self._rules[start:]:
             m = reg.match(path)
-            if m is not None:
-                if method not in rule:
-                    raise LookupError('No such method')
-                view = rule[method]
+            if m is None:
+                continue
+            converters = target[1]
+            if converters is None:
+                return target, m.groups()
+            try:
+                return target, _convert(converters, m.groups())
+            except ValueError:
+                continue
+        return None, ()
+
+    def _match(self, path, compiled=None):
+        if compiled is None:
+            compiled = self._compiled
+            if compiled is None:
+                compiled = self.compile()
+        static, buckets, wildcard = compiled
+        target = static.get(path)
+        if target is not None:
+            return target, ()
+        if not path.startswith('/') or '\n' in path:
+            # '$' also matches before a trailing newline, which throws off
+            # the static map and segment buckets. Such paths are rare.
+            return self._scan(path)
+        for match, slots, target in buckets.get(_path_segment(path),
+                                                wildcard):
+            m = match(path)
+            if m is None:
+                continue
+            if slots is None:
                 args = m.groups()
-                return view, args
-        raise LookupError('No such path')
+            else:
+                start, count, target = slots[m.lastindex]
+                args = m.groups()[start:start + count]
+            converters = target[1]
+            if converters is None:
+                return target, args
+            try:
+                return target, _convert(converters, args)
+            except ValueError:
+                # Fall through to the rules after this one
+                return self._scan(path, target[2] + 1)
+        return None, ()
+
+    def match_path(self, path):
+        """Return the rule for the first pattern matching path, and args.
+
+        The rule is the {method: view} dict, or None if nothing matches.
+        """
+        target, args = self._match(path)
+        if target is None:
+            return None, ()
+        return target[0], args
+
+    def _lookup(self, method, path):
+        for prefix, view, methods, allow in self._mounts:
+            if path.startswith(prefix):
+                if method not in methods:
+                    return None, (), allow
+                return view, (path[len(prefix):],), None
+        target, args = self._match(path)
+        if target is None:
+            return None, (), None
+        view = target[0].get(method)
+        if view is None:
+            return None, (), target[3]
+        return view, args, None
+
+    def match(self, method, path):
+        """Look up the view, without raising on a miss.
+
+        Return a (view, args, allow) triple. On a miss, view is None, and
+        allow is either the Allow header value for a 405 response, or None
+        if no rule matches the path at all.
+        """
+        if self.cache_size <= 0:
+            return self._lookup(method, path)
+
+        key = method, path
+        with self._cache_lock:
+            result = self._cache.pop(key, None)
+            if result is not None:
+                self._cache[key] = result
+                self._hits += 1
+        if result is None:
+            result = self._lookup(method, path)
+            with self._cache_lock:
+                self._misses += 1
+                self._cache[key] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def get_view(self, method, path):
+        """Look up the view."""
+        view, args, allow = self.match(method, path)
+        if view is None:
+            if allow is None:
+                raise LookupError('No such path')
+            raise LookupError('No such method')
+        return view, args
+
+    def cache_info(self):
+        """Report lookup cache statistics, like functools.lru_cache."""
+        with self._cache_lock:
+            return CacheInfo(self._hits, self._misses, self.cache_size,
+                             len(self._cache))
+
+    def cache_clear(self):
+        """Empty the lookup cache and reset its statistics."""
+        with self._cache_lock:
+            self._cache.clear()
+            self._hits = self._misses = 0
 
     def path_for(self, view):
         _, path = self.view_map[view]
         return path
+
+    def build(self, view, args=()):
+        """Build the path to a view, filling the rule's groups with args."""
+        template = self._templates[view]
+        if template is None:
+            raise ValueError('Cannot build a URL from {0!r}'.format(
+                self.path_for(view)))
+        fmt, slots = template
+        if len(args) != len(slots):
+            raise TypeError('{0!r} takes {1:d} arguments ({2:d} given)'.format(
+                self.path_for(view), len(slots), len(args)))
+        if not slots:
+            return fmt
+        return fmt.format(*[conv.to_url(arg) for conv, arg in
+                            zip(slots, args)])
@@ -0,0 +1,594 @@
+# -*- coding: utf-8 -*-
+"""A small asyncio HTTP/1.1 server.
+
+This runs a Malt app through its ASGI application, with no dependencies
+outside the standard library. Connections are kept alive between
+requests, and pipelined requests are answered in order. Headers are read
+into a buffer of bounded size, and request bodies are streamed to the
+app, up to a size limit.
+
+To use every core, run(app, workers=N) starts N worker processes that
+share the listening socket. The app is set up once in the parent, and the
+workers inherit it. Workers that die are restarted, and SIGHUP replaces
+all workers gracefully.
+
+This module needs Python 3.7 or later, so the package doesn't import it.
+
+>>> from malt.server import run
+>>> run(app, 'localhost', 5000)  # doctest: +SKIP
+"""
+
+from .exceptions import HTTPException
+from .http import HTTP_STATUS_CODES
+from email.utils import formatdate
+from urllib.parse import unquote
+import asyncio
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+
+class BadRequest(HTTPException):
+
+    """The request can't be parsed; respond with code and close.
+
+    Raised while the app reads the body, this is an HTTPException, so a
+    Malt app answers with the code instead of a 500.
+    """
+
+    def __init__(self, code=400):
+        super(BadRequest, self).__init__(code)
+        self.code = code
+
+
+class _Date(object):
+
+    """The Date header value, formatted at most once a second."""
+
+    def __init__(self):
+        self.second = None
+        self.value = None
+
+    def __call__(self):
+        now = int(time.time())
+        if now != self.second:
+            self.second = now
+            self.value = formatdate(now, usegmt=True).encode('ascii')
+        return self.value
+
+
+class Connection(object):
+
+    """State of a single client connection."""
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.idle = True
+
+    def parse_head(self, head):
+        """Parse the request line and headers into an ASGI scope."""
+        try:
+            lines = head.decode('latin1').split('\r\n')
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise BadRequest()
+        if version not in ('HTTP/1.1', 'HTTP/1.0'):
+            raise BadRequest(505)
+        if len(lines) - 3 > self.server.max_headers:
+            raise BadRequest(431)
+
+        headers = []
+        for line in lines[1:-2]:
+            name, sep, value = line.partition(':')
+            if not sep or not name or name != name.strip():
+                raise BadRequest()
+            headers.append((name.lower().encode('latin1'),
+                            value.strip().encode('latin1')))
+
+        if target.startswith(('http://', 'https://')):
+            # Absolute form, as sent to proxies
+            target = '/' + target.split('/', 3)[3] \
+                if target.count('/') >= 3 else '/'
+        path, _, query = target.partition('?')
+        return {
+            'type': 'http',
+            'asgi': {'version': '3.0', 'spec_version': '2.1'},
+            'http_version': version[5:],
+            'method': method,
+            'scheme': 'http',
+            'path': unquote(path, errors='replace'),
+            'raw_path': path.encode('latin1'),
+            'query_string': query.encode('latin1'),
+            'root_path': '',
+            'headers': headers,
+            'client': self.writer.get_extra_info('peername'),
+            'server': self.writer.get_extra_info('sockname'),
+            'extensions': {'http.response.zerocopysend': {}},
+        }
+
+    async def serve(self):
+        server = self.server
+        try:
+            while not server.closing:
+                self.idle = True
+                try:
+                    head = await asyncio.wait_for(
+                        self.reader.readuntil(b'\r\n\r\n'),
+                        server.keep_alive_timeout)
+                except asyncio.LimitOverrunError:
+                    await self.send_error(431)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError,
+                        ConnectionError):
+                    break
+                self.idle = False
+                try:
+                    scope = self.parse_head(head)
+                    keep_alive = await self.handle(scope)
+                except BadRequest as exc:
+                    await self.send_error(exc.code)
+                    break
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.writer.close()
+
+    async def send_error(self, code):
+        status = '{0:d} {1}'.format(code, HTTP_STATUS_CODES[code])
+        self.writer.write(
+            'HTTP/1.1 {0}\r\nContent-Type: text/plain; charset=utf-8\r\n'
+            'Content-Length: {1:d}\r\nConnection: close\r\n\r\n{0}\n'.format(
+                status, len(status) + 1).encode('latin1'))
+        await self.writer.drain()
+
+    async def sendfile(self, message):
+        """Send a span of a file, without copying it through Python."""
+        await self.writer.drain()
+        loop = asyncio.get_running_loop()
+        await loop.sendfile(self.writer.transport, message['file'],
+                            message.get('offset', 0), message.get('count'))
+
+    async def handle(self, scope):
+        """Run one request through the app. Return whether to keep alive."""
+        server = self.server
+        reader = self.reader
+        writer = self.writer
+        headers = dict(scope['headers'])
+        version = scope['http_version']
+        connection = headers.get(b'connection', b'').lower()
+        if version == '1.1':
+            keep_alive = b'close' not in connection
+        else:
+            keep_alive = b'keep-alive' in connection
+
+        # The body's framing is read strictly, since a proxy in front
+        # that reads it differently could be fed a smuggled request
+        lengths = set()
+        codings = []
+        for name, value in scope['headers']:
+            if name == b'content-length':
+                lengths.add(value)
+            elif name == b'transfer-encoding':
+                codings.extend(coding.strip().lower()
+                               for coding in value.split(b',')
+                               if coding.strip())
+        chunked = bool(codings)
+        if chunked:
+            if codings[-1] != b'chunked':
+                raise BadRequest()
+            if len(codings) > 1:
+                raise BadRequest(501)
+            if lengths:
+                raise BadRequest()
+        if len(lengths) > 1:
+            raise BadRequest()
+        if lengths:
+            length = lengths.pop()
+            if not length.isdigit():
+                raise BadRequest()
+            remaining = int(length)
+            if remaining > server.max_body_size:
+                raise BadRequest(413)
+        else:
+            remaining = 0
+        expect_continue = headers.get(b'expect', b'').lower() == \
+            b'100-continue'
+        # 'chunk' is what's left of the current chunk, when chunked
+        state = {'remaining': remaining, 'done': not chunked and not remaining,
+                 'received': 0, 'chunk': 0, 'ended': False}
+        response = {'started': False, 'head': None, 'chunked': False,
+                    'finished': False}
+        # Set once the response has been sent, or the app has returned
+        over = asyncio.Event()
+
+        async def disconnected():
+            # The client half-closing doesn't end the transport, so its
+            # EOF is polled for along with the end of the response
+            while not (reader.at_eof() or writer.is_closing()):
+                try:
+                    await asyncio.wait_for(over.wait(), 0.1)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+
+        async def read_chunked():
+            if not state['chunk']:
+                line = await reader.readuntil(b'\r\n')
+                try:
+                    size = int(line.split(b';', 1)[0], 16)
+                except ValueError:
+                    raise BadRequest()
+                if size == 0:
+                    # Skip the trailers
+                    while await reader.readuntil(b'\r\n') != b'\r\n':
+                        pass
+                    state['done'] = True
+                    return b''
+                if state['received'] + size > server.max_body_size:
+                    raise BadRequest(413)
+                state['chunk'] = size
+            # Large chunks are read in pieces, not buffered whole
+            data = await reader.readexactly(min(state['chunk'], 65536))
+            state['chunk'] -= len(data)
+            if not state['chunk'] and \
+                    await reader.readexactly(2) != b'\r\n':
+                raise BadRequest()
+            return data
+
+        async def receive():
+            nonlocal expect_continue
+            if state['done']:
+                if state['ended']:
+                    # The ASGI spec has this wait until the client goes
+                    # away, which apps use to stop streaming
+                    await disconnected()
+                    return {'type': 'http.disconnect'}
+                state['ended'] = True
+                return {'type': 'http.request', 'body': b''}
+            if expect_continue:
+                expect_continue = False
+                # Too late once the final response has started
+                if not response['started']:
+                    writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            if chunked:
+                data = await read_chunked()
+            else:
+                data = await reader.read(min(state['remaining'], 65536))
+                if not data:
+                    raise ConnectionError('Client disconnected')
+                state['remaining'] -= len(data)
+                state['done'] = not state['remaining']
+            state['received'] += len(data)
+            state['ended'] = state['done']
+            return {'type': 'http.request', 'body': data,
+                    'more_body': not state['done']}
+
+        async def send(message):
+            nonlocal keep_alive
+            if message['type'] == 'http.response.start':
+                response['head'] = message
+                return
+            # Zero-copy messages send a span of a file, with sendfile
+            zerocopy = message['type'] == 'http.response.zerocopysend'
+            if zerocopy:
+                body = b''
+                length = message['count']
+            else:
+                body = message.get('body', b'')
+                length = len(body)
+            more_body = message.get('more_body', False)
+            if not response['started']:
+                response['started'] = True
+                start = response['head']
+                status = start['status']
+                lines = ['HTTP/1.1 {0:d} {1}'.format(
+                    status, HTTP_STATUS_CODES.get(status, '')).encode()]
+                has_length = False
+                for name, value in start.get('headers', ()):
+                    if name.lower() == b'content-length':
+                        has_length = True
+                    lines.append(name + b': ' + value)
+                if not has_length and status >= 200 and \
+                        status not in (204, 304):
+                    if not more_body:
+                        lines.append(b'Content-Length: ' +
+                                     str(length).encode())
+                    elif scope['method'] == 'HEAD':
+                        # No body follows, so there's nothing to frame
+                        pass
+                    elif version == '1.1':
+                        response['chunked'] = True
+                        lines.append(b'Transfer-Encoding: chunked')
+                    else:
+                        keep_alive = False
+                if not state['done'] and (
+                        chunked or state['remaining'] > server.drain_size):
+                    # Too much body was left unread to skip it cheaply
+                    keep_alive = False
+                if expect_continue and not state['done']:
+                    # The client is waiting to send the body, and won't
+                    # without a 100 Continue
+                    keep_alive = False
+                if server.closing:
+                    keep_alive = False
+                if not keep_alive:
+                    lines.append(b'Connection: close')
+                elif version == '1.0':
+                    lines.append(b'Connection: keep-alive')
+                lines.append(b'Date: ' + server.date())
+                lines.append(b'\r\n')
+                writer.write(b'\r\n'.join(lines))
+            if scope['method'] == 'HEAD':
+                body = b''
+                zerocopy = False
+            if response['chunked']:
+                if body:
+                    writer.write(b'%x\r\n%s\r\n' % (len(body), body))
+                if zerocopy and length:
+                    writer.write(b'%x\r\n' % length)
+                    await self.sendfile(message)
+                    writer.write(b'\r\n')
+                if not more_body:
+                    writer.write(b'0\r\n\r\n')
+            elif body:
+                writer.write(body)
+            elif zerocopy and length:
+                await self.sendfile(message)
+            if not more_body:
+                response['finished'] = True
+                over.set()
+            await writer.drain()
+
+        try:
+            await server.app(scope, receive, send)
+        except BadRequest:
+            if response['started']:
+                return False
+            raise
+        except Exception:
+            traceback.print_exc()
+            if response['started']:
+                return False
+            raise BadRequest(500)
+        finally:
+            over.set()
+        if not response['finished']:
+            return False
+        if keep_alive:
+            while not state['done']:
+                await receive()
+        return keep_alive
+
+
+class HTTPServer(object):
+
+    """Serve a Malt app (or any ASGI application) over HTTP/1.1."""
+
+    def __init__(self, app, config=None, max_header_size=65536,
+                 max_headers=100, max_body_size=1024 * 1024 * 16,
+                 keep_alive_timeout=5):
+        self.metrics = getattr(app, 'metrics', None)
+        if hasattr(app, 'asgi_app'):
+            # Build the dispatch table now, so forked workers share it
+            app.router.compile()
+            app = app.asgi_app(config or {})
+        self.app = app
+        self.max_header_size = max_header_size
+        self.max_headers = max_headers
+        self.max_body_size = max_body_size
+        self.keep_alive_timeout = keep_alive_timeout
+        # Unread request bodies up to this size are skipped to keep alive
+        self.drain_size = 65536
+        self.closing = False
+        # Which worker process this is, when running under Prefork
+        self.worker_id = None
+        self.date = _Date()
+        self._server = None
+        self._connections = set()
+
+    async def _accept(self, reader, writer):
+        connection = Connection(self, reader, writer)
+        self._connections.add(connection)
+        try:
+            await connection.serve()
+        finally:
+            self._connections.discard(connection)
+
+    async def start(self, host=None, port=None, sock=None, reuse_port=None):
+        """Start listening, on host and port or on an existing socket."""
+        kwargs = {'limit': self.max_header_size}
+        if sock is not None:
+            kwargs['sock'] = sock
+        else:
+            kwargs.update(host=host, port=port, reuse_port=reuse_port)
+        self._server = await asyncio.start_server(self._accept, **kwargs)
+        return self._server
+
+    async def shutdown(self, timeout=30):
+        """Stop accepting, and let in-flight requests finish."""
+        self.closing = True
+        if self._server is not None:
+            self._server.close()
+        deadline = time.monotonic() + timeout
+        while self._connections and time.monotonic() < deadline:
+            for connection in list(self._connections):
+                if connection.idle:
+                    connection.writer.close()
+            await asyncio.sleep(0.05)
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    async def serve(self, host=None, port=None, sock=None, reuse_port=None):
+        """Serve until SIGINT or SIGTERM, then shut down gracefully."""
+        await self.start(host, port, sock, reuse_port)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await stop.wait()
+        await self.shutdown()
+
+
+class Prefork(object):
+
+    """Run an HTTPServer in several worker processes.
+
+    By default the parent binds the listening socket, and the workers
+    inherit it. With reuse_port, each worker binds its own socket with
+    SO_REUSEPORT instead, and the kernel balances connections between
+    them.
+
+    Worker processes that exit are replaced. On SIGHUP, a new set of
+    workers is started and the old ones are told to finish their current
+    requests and exit. SIGINT and SIGTERM stop all workers the same way,
+    then the parent exits.
+    """
+
+    def __init__(self, server, host, port, workers, reuse_port=False,
+                 timeout=30):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.reuse_port = reuse_port
+        self.timeout = timeout
+        self.sock = None
+        self.pids = {}
+        # Alternates on reload, so old and new workers get distinct ids
+        self.generation = 0
+        self._signals = []
+
+    def bind(self):
+        if self.reuse_port:
+            return None
+        sock = socket.socket(socket.AF_INET6 if ':' in self.host
+                             else socket.AF_INET)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(1024)
+        sock.setblocking(False)
+        return sock
+
+    def spawn(self, worker_id):
+        pid = os.fork()
+        if pid != 0:
+            self.pids[pid] = worker_id, time.monotonic()
+            return pid
+        # In the worker
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, signal.SIG_DFL)
+        # Reloading is the parent's job
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        status = 0
+        try:
+            self.server.worker_id = worker_id
+            if self.server.metrics is not None:
+                self.server.metrics.bind(worker_id)
+            if self.sock is not None:
+                asyncio.run(self.server.serve(sock=self.sock))
+            else:
+                asyncio.run(self.server.serve(self.host, self.port,
+                                              reuse_port=True))
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def spawn_all(self):
+        """Start a full set of workers; return their pids."""
+        pids = []
+        for i in range(self.workers):
+            pids.append(self.spawn(self.generation * self.workers + i))
+        self.generation = 1 - self.generation
+        return pids
+
+    def stop(self, pids):
+        """Ask workers to drain, and kill those still up after timeout."""
+        for pid in pids:
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.timeout
+        while any(pid in self.pids for pid in pids):
+            if time.monotonic() > deadline:
+                for pid in pids:
+                    self._kill(pid, signal.SIGKILL)
+            # Other workers, like new ones during a reload, still get
+            # replaced if they exit
+            self.reap(stopping=pids)
+            time.sleep(0.05)
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+
+    def reap(self, stopping=()):
+        """Collect exited workers, and replace any not in stopping."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid not in self.pids:
+                continue
+            worker_id, started = self.pids.pop(pid)
+            if pid not in stopping:
+                if time.monotonic() - started < 1:
+                    # Don't spin if the worker dies right on startup
+                    time.sleep(1)
+                self.spawn(worker_id)
+
+    def run(self):
+        self.sock = self.bind()
+        if self.server.metrics is not None:
+            self.server.metrics.share(self.workers * 2)
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, lambda signum, _: self._signals.append(
+                signum))
+        # Keep the objects built so far out of the collector's way, so the
+        # workers don't copy the pages they live in
+        gc.freeze()
+        self.spawn_all()
+        try:
+            while True:
+                while self._signals:
+                    signum = self._signals.pop(0)
+                    if signum == signal.SIGHUP:
+                        old = list(self.pids)
+                        self.spawn_all()
+                        self.stop(old)
+                    else:
+                        return
+                self.reap()
+                time.sleep(0.05)
+        finally:
+            self.stop(list(self.pids))
+            if self.sock is not None:
+                self.sock.close()
+
+
+def run(app, host='127.0.0.1', port=5000, config=None, workers=1,
+        reuse_port=False, **kwargs):
+    """Serve app on host and port until interrupted.
+
+    With more than one worker, this forks worker processes; see Prefork.
+    """
+    server = HTTPServer(app, config, **kwargs)
+    print('Running on http://{0}:{1:d}'.format(host, port))
+    if workers > 1:
+        Prefork(server, host, port, workers, reuse_port).run()
+    else:
+        asyncio.run(server.serve(host, port))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Static file serving.
+
+Malt.static() mounts a StaticFiles view on a URL prefix. Files up to
+max_file_size bytes are kept in a bounded LRU cache, along with their
+ETag and Last-Modified values, and checked against a fresh stat() on
+every request. Larger files, and range requests, are served by
+FileResponse, so they go out through sendfile where the server can.
+
+When the client accepts gzip and there's a precompressed sibling file,
+like app.js.gz next to app.js, the sibling is sent instead.
+"""
+
+from .exceptions import HTTPException
+from .helpers import PY2
+from .models import FileResponse, Response
+from collections import OrderedDict
+from email.utils import formatdate, mktime_tz, parsedate_tz
+import mimetypes
+import os
+import stat
+import threading
+
+
+def _accepts_gzip(header):
+    for coding in header.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() == 'gzip':
+            params = params.replace(' ', '')
+            if params.startswith('q='):
+                try:
+                    return float(params[2:]) > 0
+                except ValueError:
+                    return False
+            return True
+    return False
+
+
+class StaticFiles(object):
+
+    """A view serving the files under directory."""
+
+    def __init__(self, directory, cache_size=256, max_file_size=262144,
+                 max_age=None):
+        self.directory = os.path.abspath(directory)
+        self.cache_size = cache_size
+        self.max_file_size = max_file_size
+        self.max_age = max_age
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, subpath):
+        """Return the filesystem path for subpath, or raise a 404."""
+        if not PY2:
+            # PATH_INFO holds the raw bytes as latin1; file names are UTF-8
+            try:
+                subpath = subpath.encode('latin1').decode('utf-8')
+            except UnicodeError:
+                raise HTTPException(404)
+        parts = subpath.split('/')
+        for part in parts:
+            if part in ('', '.', '..') or '\\' in part or '\0' in part:
+                raise HTTPException(404)
+        return os.path.join(self.directory, *parts)
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except (OSError, ValueError):
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return st
+
+    def _validators(self, st):
+        mtime = getattr(st, 'st_mtime_ns', None)
+        if mtime is None:
+            mtime = int(st.st_mtime * 1000000000)
+        etag = '"{0:x}-{1:x}"'.format(mtime, st.st_size)
+        return mtime, etag, formatdate(st.st_mtime, usegmt=True)
+
+    def _not_modified(self, request, etag, st):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            # Weak comparison, as RFC 7232 asks for If-None-Match
+            return '*' in tags or etag in tags or 'W/' + etag in tags
+        if_modified_since = request.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            since = parsedate_tz(if_modified_since)
+            if since is not None:
+                return int(st.st_mtime) <= mktime_tz(since)
+        return False
+
+    def _cached(self, path, mtime, size):
+        key = path, mtime, size
+        with self._lock:
+            data = self._cache.pop(key, None)
+            if data is not None:
+                self._cache[key] = data
+                return data
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) != size:
+            # Changed since the stat; don't cache it
+            return data
+        with self._lock:
+            self._cache[key] = data
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return data
+
+    def __call__(self, request, subpath):
+        path = self.resolve(subpath)
+        st = self._stat(path)
+        if st is None:
+            raise HTTPException(404)
+        mimetype = mimetypes.guess_type(path)[0] or \
+            'application/octet-stream'
+
+        encoding = None
+        gz_st = self._stat(path + '.gz')
+        if gz_st is not None and \
+                _accepts_gzip(request.headers.get('Accept-Encoding', '')):
+            path, st, encoding = path + '.gz', gz_st, 'gzip'
+
+        mtime, etag, last_modified = self._validators(st)
+        if self._not_modified(request, etag, st):
+            response = Response(code=304)
+            del response.headers['Content-Type']
+        elif st.st_size <= self.max_file_size and \
+                'Range' not in request.headers:
+            response = Response(self._cached(path, mtime, st.st_size),
+                                mimetype=mimetype)
+        else:
+            response = FileResponse(open(path, 'rb'), mimetype=mimetype)
+
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = last_modified
+        if encoding is not None and response.status_code != 304:
+            response.headers['Content-Encoding'] = encoding
+        if gz_st is not None:
+            response.headers['Vary'] = 'Accept-Encoding'
+        if self.max_age is not None:
+            response.headers['Cache-Control'] = \
+                'public, max-age={0:d}'.format(self.max_age)
+        return response
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Per-request stage timing."""
+
+import time
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class Timer(object):
+
+    """Record how long each stage of a request takes.
+
+    Each call to mark() ends a stage, which started at the previous mark.
+    Durations are in seconds.
+    """
+
+    def __init__(self):
+        self.start = self.last = monotonic()
+        self.stages = []
+        self.total = None
+
+    def mark(self, stage):
+        now = monotonic()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def finish(self):
+        self.total = self.last - self.start
+        return self.total
+
+    def header(self):
+        """Format the stages as a Server-Timing header value."""
+        parts = ['{0};dur={1:.3f}'.format(stage, duration * 1000)
+                 for stage, duration in self.stages]
+        if self.total is not None:
+            parts.append('total;dur={0:.3f}'.format(self.total * 1000))
+        return ', '.join(parts)
@@ -1,25 +1,84 @@
 # -*- coding: utf-8 -*-
 """Some utility functions."""
 
-from json import dumps
-from .http import MIME_JSON
+from .http import MIME_JSON, MIME_NDJSON
+from .jsonlib import get_backend
 from .models import Response
 
+# Keyword arguments passed on to the standard library's json.dumps
+_DUMPS_OPTIONS = ('ensure_ascii', 'separators', 'indent')
 
-def json_response(data, pretty=False, **kwargs):
+
+def json_response(data, pretty=False, backend=None, sort_keys=True,
+                  **kwargs):
+    """Return a Response with data encoded as JSON.
+
+    The body is encoded straight to UTF-8 bytes, and Content-Length is set
+    from it. backend is a malt.jsonlib backend, or its name. Passing any
+    of ensure_ascii, separators or indent uses the standard library.
+    """
     kwargs.setdefault('mimetype', MIME_JSON)
-    if pretty:
-        kwargs.setdefault('ensure_ascii', True)
-        kwargs.setdefault('separators', None)
-        kwargs.setdefault('indent', 2)
-    else:
-        kwargs.setdefault('ensure_ascii', False)
-        kwargs.setdefault('separators', (',', ':'))
-        kwargs.setdefault('indent', None)
-
-    text = dumps(data,
-                 ensure_ascii=kwargs.pop('ensure_ascii'),
-                 separators=kwargs.pop('separators'),
-                 indent=kwargs.pop('indent'),
-                 sort_keys=True) + u'\n'
-    return Response(text, **kwargs)
+    options = dict((key, kwargs.pop(key)) for key in _DUMPS_OPTIONS
+                   if key in kwargs)
+    if options:
+        backend = 'json'
+    body = get_backend(backend).dumps(data, sort_keys=sort_keys,
+                                      pretty=pretty, **options) + b'\n'
+    response = Response(body, **kwargs)
+    response.headers['Content-Length'] = str(len(body))
+    return response
+
+
+def _encode_stream(items, encode, chunk_size, head, separator, tail):
+    """Encode items, and yield them joined in chunks of about chunk_size.
+
+    The first item is sent on its own, so the first byte goes out early.
+    """
+    batch = [head]
+    size = len(head)
+    flushed = False
+    try:
+        for i, item in enumerate(items):
+            if i:
+                batch.append(separator)
+                size += len(separator)
+            data = encode(item)
+            batch.append(data)
+            size += len(data)
+            if size >= chunk_size or not flushed:
+                yield b''.join(batch)
+                batch = []
+                size = 0
+                flushed = True
+        batch.append(tail)
+        data = b''.join(batch)
+        if data:
+            yield data
+    finally:
+        close = getattr(items, 'close', None)
+        if close is not None:
+            close()
+
+
+def json_stream_response(items, chunk_size=65536, backend=None,
+                         sort_keys=True, **kwargs):
+    """Return a Response streaming items, any iterable, as a JSON array.
+
+    Items are encoded as they're read, so memory use doesn't depend on how
+    many there are.
+    """
+    kwargs.setdefault('mimetype', MIME_JSON)
+    backend = get_backend(backend)
+    return Response(_encode_stream(
+        items, lambda item: backend.dumps(item, sort_keys=sort_keys),
+        chunk_size, b'[', b',', b']\n'), **kwargs)
+
+
+def ndjson_response(items, chunk_size=65536, backend=None, sort_keys=True,
+                    **kwargs):
+    """Return a Response streaming items as newline-delimited JSON."""
+    kwargs.setdefault('mimetype', MIME_NDJSON)
+    backend = get_backend(backend)
+    return Response(_encode_stream(
+        items, lambda item: backend.dumps(item, sort_keys=sort_keys) + b'\n',
+        chunk_size, b'', b'', b''), **kwargs)
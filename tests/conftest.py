@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.extend(['test_asgi.py', 'test_server.py'])
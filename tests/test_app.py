@@ -83,13 +83,23 @@ def test_wsgi_exceptions():
         assert resp.status_code == status_code
         assert resp.status == status
 
+        headers = [('Content-Type', 'text/plain; charset=utf-8')]
+        if status_code == 405:
+            headers.append(('Allow', 'GET'))
+        headers.append(('Content-Length', str(len(text))))
         assert list(wsgi(environ, start_request)) == [text]
-        assert arr[0] == (status, [('Content-Type',
-                                    'text/plain; charset=utf-8')])
+        assert arr[0] == (status, headers)
 
 
 def test_url_for():
-    assert app.url_for(internal) == r'^/internal$'
+    assert app.url_for(internal) == '/internal'
+    assert app.url_for(root) == '/'
+    assert app.url_for(thing, 50) == '/things/50'
+    assert app.url_for(thing, 'a b/c') == '/things/a%20b%2Fc'
+    assert app.url_for(root, q='x y', a=[1, 2]) == '/?a=1&a=2&q=x+y'
+
+    with pytest.raises(TypeError):
+        app.url_for(thing)
 
     with pytest.raises(KeyError):
         app.url_for(not_a_view)
@@ -99,7 +109,7 @@ def test_dispatch_error(monkeypatch):
     def raises_lookup_error(method, path):
         raise LookupError('Some unexpected message')
 
-    monkeypatch.setattr(app.router, 'get_view', raises_lookup_error)
+    monkeypatch.setattr(app.router, 'match', raises_lookup_error)
 
     req = Request({
         'REQUEST_METHOD': 'GET',
@@ -163,3 +173,114 @@ def test_sessions():
     set_cookie = next(v for k, v in headers[0] if k.lower() == 'set-cookie')
     expected = 'eyJhIjoyfQ.WW2DtOr1pkaM9nrC9sw2kHW3Cxd57hDhLie--g46DjE'
     assert set_cookie == 'session=' + expected
+
+
+def test_timing():
+    a = Malt()
+    recorded = []
+
+    @a.timing_handler
+    def record(request, response, timer):
+        recorded.append((response.status_code, timer))
+
+    @a.get('^/$')
+    def root(request):
+        return Response('Hello')
+
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+    headers = []
+    wsgi = a.wsgi_app({'SESSIONS': True, 'SECRET_KEY': 'abc',
+                       'SERVER_TIMING': True})
+    wsgi(environ, lambda status, h: headers.extend(h))
+
+    [(status, timer)] = recorded
+    assert status == 200
+    assert [stage for stage, _ in timer.stages] == [
+        'session_open', 'before', 'routing', 'view', 'after', 'session_save']
+    assert timer.total >= sum(duration for _, duration in timer.stages)
+    server_timing = dict(headers)['Server-Timing']
+    assert server_timing.startswith('session_open;dur=')
+    assert 'total;dur=' in server_timing
+
+    # Without a handler or SERVER_TIMING, nothing gets timed
+    request = Request(environ, {})
+    a._timing_handlers = []
+    a.start_timing(request)
+    assert request.timer is None
+
+
+def test_freeze():
+    a = Malt()
+    calls = []
+
+    @a.before_request
+    def before(request):
+        calls.append('before')
+
+    @a.get('^/$')
+    def root(request):
+        return Response(u'{0}\n'.format(sorted(request.config)))
+
+    @a.get('^/session$')
+    def session(request):
+        # The config is shared, so it's read-only
+        with pytest.raises(TypeError):
+            request.config['x'] = 'y'
+        request.session['a'] = 1
+        return Response('')
+
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+    responses = []
+
+    def start_response(status, headers):
+        responses.append((status, headers))
+
+    config = {'a': 'b'}
+    wsgi = a.freeze(config)
+    config['c'] = 'd'
+    assert list(wsgi(environ, start_response)) == [b"['a']\n"]
+    assert calls == ['before']
+
+    with pytest.raises(RuntimeError):
+        a.get('^/new$')(root)
+    with pytest.raises(RuntimeError):
+        a.before_request(before)
+    with pytest.raises(RuntimeError):
+        a.router.add_rule('POST', '^/$', root)
+
+    wsgi = a.freeze({'SESSIONS': True, 'SECRET_KEY': 'abc'})
+    environ['PATH_INFO'] = '/session'
+    wsgi(environ, start_response)
+    assert any(k == 'Set-Cookie' for k, _ in responses[-1][1])
+    assert calls == ['before', 'before']
+
+    # Timing needs the generic path
+    wsgi = a.freeze({'SERVER_TIMING': True})
+    environ['PATH_INFO'] = '/'
+    wsgi(environ, start_response)
+    assert any(k == 'Server-Timing' for k, _ in responses[-1][1])
+
+
+def test_request_class():
+    class MyRequest(Request):
+        __slots__ = ()
+
+    a = Malt()
+    a.request_class = MyRequest
+
+    @a.before_request
+    def before(request):
+        request.user = 'someone'
+
+    @a.get('^/$')
+    def root(request):
+        return Response(u'{0} {1}\n'.format(type(request).__name__,
+                                            request.user))
+
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+    wsgi = a.wsgi_app({})
+    assert list(wsgi(environ, lambda s, h: None)) == [b'MyRequest someone\n']
+    wsgi = a.freeze({})
+    assert list(wsgi(environ, lambda s, h: None)) == [b'MyRequest someone\n']
+    wsgi = a.freeze({'SESSIONS': True, 'SECRET_KEY': 'abc'})
+    assert list(wsgi(environ, lambda s, h: None)) == [b'MyRequest someone\n']
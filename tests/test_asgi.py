@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Test the ASGI application."""
+
+from malt import Malt, Response, json as jsonify
+import asyncio
+import json
+import threading
+
+
+def run(asgi, method, path, body=b'', headers=(), chunk_size=None):
+    """Send one request through asgi, and collect the response."""
+    chunk_size = chunk_size or max(len(body), 1)
+    chunks = [body[i:i + chunk_size]
+              for i in range(0, len(body), chunk_size)] or [b'']
+    messages = []
+
+    async def receive():
+        chunk = chunks.pop(0)
+        return {'type': 'http.request', 'body': chunk,
+                'more_body': bool(chunks)}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': b'a=1',
+        'headers': [(k.encode(), v.encode()) for k, v in headers],
+        'server': ('localhost', 8000),
+        'client': ('127.0.0.1', 50000),
+    }
+    asyncio.run(asgi(scope, receive, send))
+    start = messages[0]
+    body = b''.join(m.get('body', b'') for m in messages[1:])
+    assert not messages[-1].get('more_body', False)
+    return start['status'], dict(start['headers']), body
+
+
+def make_app():
+    app = Malt()
+    threads = []
+
+    @app.before_request
+    async def before(request):
+        if request.path == '/before':
+            return Response('before\n')
+
+    @app.after_request
+    def after(request, response):
+        response.headers['X-After'] = 'yes'
+        return response
+
+    @app.get('^/sync$')
+    def sync_view(request):
+        threads.append(threading.current_thread())
+        return Response('sync ' + request.url + '\n')
+
+    @app.get('^/async/<int>$')
+    async def async_view(request, n):
+        await asyncio.sleep(0)
+        return jsonify({'n': n})
+
+    @app.post('^/echo$')
+    def echo(request):
+        return Response(request.data())
+
+    @app.post('^/async-echo$')
+    async def async_echo(request):
+        await request.stream.load()
+        return jsonify(request.json())
+
+    @app.get('^/stream$')
+    def stream(request):
+        def gen():
+            for i in range(3):
+                yield str(i)
+        return Response(gen())
+
+    @app.get('^/astream$')
+    async def astream(request):
+        async def gen():
+            for i in range(3):
+                yield str(i)
+        return Response(gen())
+
+    @app.get('^/error$')
+    async def error(request):
+        1/0
+
+    return app, threads
+
+
+def test_views():
+    app, threads = make_app()
+    asgi = app.asgi_app({})
+
+    status, headers, body = run(asgi, 'GET', '/sync')
+    assert status == 200
+    assert headers[b'X-After'] == b'yes'
+    assert body == b'sync http://localhost:8000/sync?a=1\n'
+    assert threads[0] is not threading.main_thread()
+
+    status, _, body = run(asgi, 'GET', '/async/5')
+    assert json.loads(body.decode()) == {'n': 5}
+
+    assert run(asgi, 'GET', '/before')[2] == b'before\n'
+    assert run(asgi, 'GET', '/error')[0] == 500
+    assert run(asgi, 'GET', '/missing')[0] == 404
+    status, headers, _ = run(asgi, 'PUT', '/sync')
+    assert status == 405
+    assert headers[b'Allow'] == b'GET'
+
+
+def test_request_class():
+    app, _ = make_app()
+
+    class MyRequest(app.request_class):
+        __slots__ = ()
+
+    app.request_class = MyRequest
+
+    @app.get('^/class$')
+    def request_class(request):
+        return Response(type(request).__name__)
+
+    assert run(app.asgi_app({}), 'GET', '/class')[2] == b'MyRequest'
+
+
+def test_streaming():
+    app, _ = make_app()
+    asgi = app.asgi_app({})
+
+    body = b'x' * 1000
+    assert run(asgi, 'POST', '/echo', body, chunk_size=100,
+               headers=[('Content-Length', '1000')])[2] == body
+    assert run(asgi, 'POST', '/async-echo', b'{"a": [1, 2]}', chunk_size=3,
+               headers=[('Content-Length', '13')])[2] == b'{"a":[1,2]}\n'
+    assert run(asgi, 'GET', '/stream')[2] == b'012'
+    assert run(asgi, 'GET', '/astream')[2] == b'012'
+
+
+def test_sessions():
+    app = Malt()
+
+    @app.get('^/$')
+    async def count(request):
+        request.session['n'] = request.session.get('n', 0) + 1
+        return Response(str(request.session['n']))
+
+    asgi = app.asgi_app({'SESSIONS': True, 'SECRET_KEY': 'abc'})
+    _, headers, body = run(asgi, 'GET', '/')
+    assert body == b'1'
+    cookie = headers[b'Set-Cookie'].decode()
+    _, _, body = run(asgi, 'GET', '/', headers=[('Cookie', cookie)])
+    assert body == b'2'
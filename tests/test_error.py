@@ -117,3 +117,30 @@ def test_error_in_response():
     response = app.get_response(secretly_bad_response)
     with pytest.raises(Exception):
         list(response)
+
+
+def test_not_found_and_not_allowed():
+    app = Malt()
+
+    @app.get('^/$')
+    @app.post('^/$')
+    def root(request):
+        return Response('root')
+
+    for _ in range(2):
+        response = app.dispatch(Request({'REQUEST_METHOD': 'GET',
+                                         'PATH_INFO': '/missing'}, {}))
+        assert response.status_code == 404
+        assert '<h1>404 Not Found</h1>' in response.response[0]
+
+        response = app.dispatch(Request({'REQUEST_METHOD': 'PUT',
+                                         'PATH_INFO': '/'}, {}))
+        assert response.status_code == 405
+        assert response.headers['Allow'] == 'GET, POST'
+
+    def custom_not_found():
+        raise HTTPException(404, 'Custom')
+
+    response = app.get_response(custom_not_found)
+    assert '<h1>404 Custom</h1>' in response.response[0]
+    assert sorted(app._error_pages) == [404, 405]
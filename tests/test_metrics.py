@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Test the per-route metrics."""
+
+from malt import Malt, Response
+from malt.metrics import UNMATCHED
+import os
+import pytest
+
+
+def make_app():
+    app = Malt()
+    app.enable_metrics('^/metrics$')
+
+    @app.get('^/things/<int>$')
+    def thing(request, n):
+        if n == 0:
+            1/0
+        return Response('thing')
+
+    return app, app.wsgi_app({})
+
+
+def get(wsgi, path):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+    return b''.join(wsgi(environ, lambda status, headers: None))
+
+
+def test_metrics():
+    app, wsgi = make_app()
+    for path in ('/things/1', '/things/2', '/things/0', '/missing'):
+        get(wsgi, path)
+
+    stats = app.metrics.snapshot()
+    assert sorted(stats) == [UNMATCHED, '^/things/<int>$']
+    thing = stats['^/things/<int>$']
+    assert thing['requests'] == 3
+    assert thing['status'] == {'2xx': 2, '5xx': 1}
+    assert thing['buckets'][-1] == (float('inf'), 3)
+    assert thing['sum'] >= 0
+    assert stats[UNMATCHED]['status'] == {'4xx': 1}
+
+    text = get(wsgi, '/metrics').decode('utf-8')
+    assert 'malt_requests_total{route="^/things/<int>$"} 3\n' in text
+    assert ('malt_responses_total{route="^/things/<int>$",status="5xx"} 1\n'
+            in text)
+    assert ('malt_request_duration_seconds_bucket{route="^/things/<int>$",'
+            'le="+Inf"} 3\n' in text)
+
+    # Each family's lines are together, after its TYPE line
+    families = []
+    for line in text.splitlines():
+        name = line.split()[2] if line.startswith('#') else \
+            line.split('{')[0]
+        if name.startswith('malt_request_duration_seconds'):
+            name = 'malt_request_duration_seconds'
+        if not families or families[-1] != name:
+            families.append(name)
+    assert families == ['malt_requests_total', 'malt_responses_total',
+                        'malt_request_duration_seconds']
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_shared_metrics():
+    app, wsgi = make_app()
+    get(wsgi, '/things/1')
+    app.metrics.share(2)
+
+    pid = os.fork()
+    if pid == 0:
+        app.metrics.bind(1)
+        get(wsgi, '/things/2')
+        get(wsgi, '/things/3')
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    app.metrics.bind(0)
+    get(wsgi, '/things/4')
+    stats = app.metrics.snapshot()
+    assert stats['^/things/<int>$']['requests'] == 4
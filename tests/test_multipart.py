@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Test multipart/form-data parsing."""
+
+from malt import HTTPException, Request
+from malt.multipart import MultipartParser, parse_options_header
+import io
+import pytest
+
+BODY = (
+    b'preamble\r\n'
+    b'--xyz\r\n'
+    b'Content-Disposition: form-data; name="title"\r\n'
+    b'\r\n'
+    b'Hello \xe2\x98\x83\r\n'
+    b'--xyz\r\n'
+    b'Content-Disposition: form-data; name="tag"\r\n'
+    b'\r\n'
+    b'a\r\n'
+    b'--xyz\r\n'
+    b'Content-Disposition: form-data; name="tag"\r\n'
+    b'\r\n'
+    b'b\r\n'
+    b'--xyz\r\n'
+    b'Content-Disposition: form-data; name="upload"; filename="a \\"b\\".txt"'
+    b'\r\n'
+    b'Content-Type: text/plain\r\n'
+    b'\r\n'
+    b'line one\r\n--xy line two\r\n'
+    b'--xyz--\r\n'
+    b'epilogue'
+)
+
+
+class Trickle(object):
+
+    """A stream that returns a few bytes per read."""
+
+    def __init__(self, data, size):
+        self.data = io.BytesIO(data)
+        self.size = size
+
+    def read(self, size=-1):
+        return self.data.read(min(size, self.size))
+
+
+def make_request(body=BODY, trickle=None, **config):
+    stream = io.BytesIO(body) if trickle is None else Trickle(body, trickle)
+    return Request({
+        'CONTENT_TYPE': 'multipart/form-data; boundary=xyz',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': stream,
+    }, config)
+
+
+def test_options_header():
+    assert parse_options_header('text/plain') == ('text/plain', {})
+    assert parse_options_header(
+        'form-data; name="a;b"; filename*=UTF-8\'\'na%C3%AFve.txt') == (
+        'form-data', {'name': 'a;b', 'filename': u'naïve.txt'})
+
+
+@pytest.mark.parametrize('trickle', [None, 1, 3, 7])
+def test_form(trickle):
+    request = make_request(trickle=trickle)
+    assert request.form.items() == [
+        ('title', u'Hello ☃'), ('tag', u'a'), ('tag', u'b')]
+    assert request.form['tag'] == u'a'
+    assert request.form.getlist('tag') == [u'a', u'b']
+    assert 'upload' not in request.form
+
+    upload = request.files['upload']
+    assert upload.filename == 'a "b".txt'
+    assert upload.content_type == 'text/plain'
+    assert upload.size == 23
+    assert upload.read() == b'line one\r\n--xy line two'
+    out = io.BytesIO()
+    upload.save(out)
+    assert out.getvalue() == b'line one\r\n--xy line two'
+
+
+def test_spooling():
+    request = make_request(BODY_SPOOL_SIZE=16)
+    assert request.files['upload'].stream._rolled
+    assert request.form['title'] == u'Hello ☃'
+
+    # Fields have to fit in memory
+    request = make_request(BODY_SPOOL_SIZE=4)
+    with pytest.raises(HTTPException) as exc_info:
+        request.form
+    assert exc_info.value.status_code == 413
+
+
+def test_limits():
+    with pytest.raises(HTTPException) as exc_info:
+        make_request(MAX_FORM_PARTS=3).form
+    assert exc_info.value.status_code == 413
+    with pytest.raises(HTTPException) as exc_info:
+        make_request(MAX_PART_SIZE=20).files
+    assert exc_info.value.status_code == 413
+    assert len(make_request(MAX_FORM_PARTS=4, MAX_PART_SIZE=23).files) == 1
+
+    with pytest.raises(HTTPException) as exc_info:
+        make_request(BODY[:-20]).form
+    assert exc_info.value.status_code == 400
+    with pytest.raises(HTTPException) as exc_info:
+        list(MultipartParser([b'--xyz\r\nbad header\r\n\r\n'], b'xyz'))
+    assert exc_info.value.status_code == 400
+    with pytest.raises(HTTPException) as exc_info:
+        list(MultipartParser([b'--xyz\r\nX: ' + b'x' * 100], b'xyz',
+                             max_header_size=64))
+    assert exc_info.value.status_code == 413
+
+
+def test_iter_parts():
+    request = make_request(trickle=5)
+    seen = []
+    for part in request.iter_parts():
+        if part.name == 'upload':
+            chunks = list(part)
+            assert all(len(chunk) <= 5 for chunk in chunks)
+            seen.append((part.name, b''.join(chunks)))
+        elif part.name == 'tag':
+            # Unread data is skipped
+            seen.append((part.name, None))
+        else:
+            seen.append((part.name, part.read()))
+    assert seen == [
+        ('title', b'Hello \xe2\x98\x83'), ('tag', None), ('tag', None),
+        ('upload', b'line one\r\n--xy line two')]
+
+    request = Request({'CONTENT_TYPE': 'text/plain'}, {})
+    with pytest.raises(HTTPException):
+        request.iter_parts()
+    assert len(request.form) == 0
+    assert len(request.files) == 0
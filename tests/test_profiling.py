@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Test the sampling profiler."""
+
+from malt import Malt, Response
+import os
+
+
+def make_app(**kwargs):
+    app = Malt()
+    app.enable_profiling(**kwargs)
+
+    @app.get('^/things/<int>$')
+    def thing(request, n):
+        return Response('thing')
+
+    @app.get('^/other$')
+    def other(request):
+        return Response('other')
+
+    return app, app.wsgi_app({})
+
+
+def get(wsgi, path):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+    return b''.join(wsgi(environ, lambda status, headers: None))
+
+
+def test_every(tmpdir):
+    app, wsgi = make_app(every=2)
+    for i in range(10):
+        assert get(wsgi, '/things/{0:d}'.format(i)) == b'thing'
+    get(wsgi, '/missing')
+    get(wsgi, '/missing')
+
+    assert len(app.profiler.profiles) == 6
+    stats = app.profiler.stats()
+    assert sorted(stats) == ['<unmatched>', '^/things/<int>$']
+    assert stats['^/things/<int>$'].total_calls > 0
+
+    filenames = app.profiler.dump_stats(str(tmpdir))
+    assert os.path.basename(filenames['^/things/<int>$']) == \
+        'things_int.pstats'
+    assert os.path.exists(filenames['<unmatched>'])
+
+
+def test_paths():
+    app, wsgi = make_app(every=0, paths=['^/other'])
+    get(wsgi, '/things/1')
+    get(wsgi, '/other')
+    assert [route for route, _, _ in app.profiler.profiles] == ['^/other$']
+
+
+def test_slow():
+    app, wsgi = make_app(every=0, slow=0, capacity=2)
+    # Unsampled slow requests get the next one to the same path profiled
+    get(wsgi, '/other')
+    assert not app.profiler.slow_profiles
+    get(wsgi, '/other')
+    assert len(app.profiler.slow_profiles) == 1
+    assert not app.profiler.profiles
@@ -92,6 +92,28 @@ def test_headers():
 
     assert set(request.headers) == set(['Content-Type', 'Content-Length',
                                         'Host', 'X-Auth-Key'])
+    assert len(request.headers) == 4
+    assert sorted(request.headers.items()) == [
+        ('Content-Length', '42'),
+        ('Content-Type', 'text/plain; charset=utf-8'),
+        ('Host', 'example.com'),
+        ('X-Auth-Key', 'the auth key'),
+    ]
+
+
+def test_header_lists():
+    request = Request({
+        'CONTENT_TYPE': 'text/plain',
+        'HTTP_CONTENT_TYPE': 'text/html',
+        'HTTP_ACCEPT': 'text/html, application/json;q=0.9',
+        'HTTP_X_LATIN': b'caf\xe9'.decode('latin1'),
+    }, {})
+    assert request.headers.getlist('Accept') == ['text/html',
+                                                 'application/json;q=0.9']
+    assert request.headers.getlist('x-missing') == []
+    assert request.headers['Content-Type'] == 'text/plain'
+    assert request.headers['X_LATIN'] == u'caf\xe9'
+    assert list(request.headers).count('Content-Type') == 1
 
 
 def test_data():
@@ -142,3 +164,152 @@ def test_cookies():
         u'empty_value': u'',
         u'key_only': None,
     }
+
+
+def test_cached_fields():
+    environ = {
+        'CONTENT_LENGTH': '3',
+        'HTTP_COOKIE': 'a=b',
+        'HTTP_HOST': 'example.com',
+        'PATH_INFO': '/',
+        'SCRIPT_NAME': '',
+        'wsgi.url_scheme': 'http',
+    }
+    request = Request(environ, {})
+    assert request.content_length == 3
+    assert request.url == 'http://example.com/'
+    assert request.host == 'example.com'
+    cookies = request.cookies
+    assert request.cookies is cookies
+
+    # Computed once, so later environ changes aren't seen
+    environ['HTTP_HOST'] = 'other.com'
+    assert request.host == 'example.com'
+    assert request.url == 'http://example.com/'
+
+    assert Request({'CONTENT_LENGTH': 'x'}, {}).content_length is None
+    assert Request({}, {}).content_length is None
+
+    # Hooks can still hang their own state on the request
+    request.user = 'someone'
+    assert request.user == 'someone'
+
+
+def test_body_streaming():
+    def req(data, length=None, **config):
+        environ = {'wsgi.input': io.BytesIO(data)}
+        if length is None:
+            environ['wsgi.input_terminated'] = True
+        else:
+            environ['CONTENT_LENGTH'] = length
+        return Request(environ, config)
+
+    assert list(req(b'abcdefg', '7').iter_chunks(3)) == [b'abc', b'def', b'g']
+    assert list(req(b'abcdefg', '5').iter_chunks(3)) == [b'abc', b'de']
+    assert list(req(b'abcdefg').iter_chunks(4)) == [b'abcd', b'efg']
+    assert req(b'abcdefg').data() == b'abcdefg'
+    assert list(req(b'abc', 'x').iter_chunks()) == []
+
+    request = req(b'abcdefg', '7')
+    buf = bytearray(4)
+    assert request.readinto(buf) == 4
+    assert buf == b'abcd'
+    assert request.readinto(buf) == 3
+    assert buf[:3] == b'efg'
+    assert request.readinto(buf) == 0
+
+    # Too large, by the header or once read
+    with pytest.raises(HTTPException) as exc_info:
+        req(b'abcdefg', '7', MAX_CONTENT_LENGTH=6).data()
+    assert exc_info.value.status_code == 413
+    with pytest.raises(HTTPException) as exc_info:
+        list(req(b'abcdefg', MAX_CONTENT_LENGTH=6).iter_chunks(2))
+    assert exc_info.value.status_code == 413
+    assert req(b'abcdef', MAX_CONTENT_LENGTH=6).data() == b'abcdef'
+
+    # Spooled to disk past the threshold
+    request = req(b'abcdefg', '7', BODY_SPOOL_SIZE=4)
+    body = request.body()
+    assert body._rolled
+    assert body.read() == b'abcdefg'
+    assert request.data() == b'abcdefg'
+    assert request.body() is body
+
+    request = req(b'abc', '3')
+    assert request.data() == b'abc'
+    assert request.body().read() == b'abc'
+
+
+def test_args():
+    request = Request({
+        'QUERY_STRING': 'a=1&b=x+y&a=%E2%98%83&&empty=&flag&c%5B%5D=3',
+    }, {})
+    assert request.args.items() == [
+        ('a', '1'), ('b', 'x y'), ('a', u'☃'), ('empty', ''), ('flag', ''),
+        ('c[]', '3')]
+    assert request.args['a'] == '1'
+    assert request.args.getlist('a') == ['1', u'☃']
+    assert request.args.get('missing') is None
+    assert request.args is request.args
+    assert len(Request({}, {}).args) == 0
+
+    request = Request({'QUERY_STRING': 'a=1&b=2&c=3'},
+                      {'MAX_FORM_PARAMS': 2})
+    with pytest.raises(HTTPException) as exc_info:
+        request.args
+    assert exc_info.value.status_code == 400
+    request = Request({'QUERY_STRING': 'a=1&b=2&'}, {'MAX_FORM_PARAMS': 2})
+    assert len(request.args) == 2
+
+
+def test_urlencoded_form():
+    def req(data, **config):
+        return Request({
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(data)),
+            'wsgi.input': io.BytesIO(data),
+        }, config)
+
+    request = req(b'name=J%C3%BCrgen+M&tag=a&tag=b')
+    assert request.form.items() == [
+        ('name', u'Jürgen M'), ('tag', 'a'), ('tag', 'b')]
+    assert len(request.files) == 0
+    # The body can still be read afterwards
+    assert request.data() == b'name=J%C3%BCrgen+M&tag=a&tag=b'
+    assert list(request.iter_chunks(16)) == [b'name=J%C3%BCrgen',
+                                             b'+M&tag=a&tag=b']
+
+    with pytest.raises(HTTPException) as exc_info:
+        req(b'a=1&b=2', MAX_FORM_PARAMS=1).form
+    assert exc_info.value.status_code == 413
+
+
+def test_json_backend():
+    class Backend(object):
+        calls = []
+
+        def loads(self, data):
+            self.calls.append(data)
+            return {'parsed': data}
+
+    environ = {
+        'CONTENT_LENGTH': '8',
+        'CONTENT_TYPE': 'application/json',
+        'wsgi.input': io.BytesIO(b'{"a": 1}'),
+    }
+    request = Request(dict(environ), {})
+    assert request.json() == {'a': 1}
+    assert request.json() is request.json()
+
+    environ['wsgi.input'] = io.BytesIO(b'{"a": 1}')
+    request = Request(environ, {})
+    request.json_backend = Backend()
+    # Passed as bytes, and only parsed once
+    assert request.json() == {'parsed': b'{"a": 1}'}
+    assert request.json() == {'parsed': b'{"a": 1}'}
+    assert Backend.calls == [b'{"a": 1}']
+
+    request = Request(environ, {})
+    request.json_backend = 'nope'
+    with pytest.raises(ValueError):
+        request.json()
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 """Test the request wrapper."""
 
-from malt import Response
+from malt import FileResponse, Response
+from malt.models import parse_range
+from wsgiref.util import FileWrapper
+import io
 import pytest
 
 
@@ -35,7 +38,60 @@ def test_response_iterable():
 def test_response_text():
     assert list(Response(b'Some text')) == [b'Some text']
     assert list(Response(u'Some text')) == [b'Some text']
-    assert list(Response([b'abc', 'déf'])) == [b'abc', b'd\xc3\xa9f']
+    assert list(Response([b'abc', 'déf'])) == [b'abcd\xc3\xa9f']
+
+
+def test_response_buffering():
+    def gen():
+        for i in range(10):
+            yield u'{0:d},'.format(i)
+    response = Response(gen())
+    response.buffer_size = 8
+    assert list(response) == [b'0,1,2,3,', b'4,5,6,7,', b'8,9,']
+
+    # Streamed bodies are sent as they're made by default
+    assert len(list(Response(gen()))) == 10
+    assert list(Response([b'a', b'b'])) == [b'ab']
+
+    big = b'x' * 20
+    response = Response([b'a', big, b'b'])
+    response.buffer_size = 8
+    chunks = list(response)
+    assert chunks == [b'a' + big, b'b']
+
+    response = Response(gen())
+    response.buffer_size = 0
+    assert len(list(response)) == 10
+
+    closed = []
+
+    class Body(list):
+        def close(self):
+            closed.append(True)
+    Response(Body()).close()
+    assert closed == [True]
+    Response([b'abc']).close()
+
+
+def test_content_length():
+    response = Response([b'abc', u'd\xe9f'])
+    response.prepare({})
+    assert response.headers['Content-Length'] == '7'
+    assert response.response == [b'abc', b'd\xc3\xa9f']
+
+    response = Response(iter([b'abc']))
+    response.prepare({})
+    assert 'Content-Length' not in response.headers
+
+    for code in (204, 304):
+        response = Response(code=code)
+        response.prepare({})
+        assert 'Content-Length' not in response.headers
+
+    response = Response(b'abc')
+    response.headers['Content-Length'] = '10'
+    response.prepare({})
+    assert response.headers['Content-Length'] == '10'
 
 
 def test_unicode_response():
@@ -84,6 +140,36 @@ def test_response_headers():
     assert exc_info.value.args[0] == 'Headers.add does not expect a list'
 
 
+def test_response_headers_grouping():
+    response = Response()
+    response.headers.add('Set-Cookie', 'a=1')
+    response.headers['Vary'] = 'Origin'
+    response.headers.add('set-cookie', 'b=2')
+    response.headers.add('X-Other', 'x')
+    assert list(response.headers) == [
+        ('Content-Type', 'text/plain; charset=utf-8'),
+        ('Set-Cookie', 'a=1'), ('Set-Cookie', 'b=2'),
+        ('Vary', 'Origin'), ('X-Other', 'x')]
+    assert len(response.headers) == 5
+
+    # Replacing keeps the position
+    response.headers['SET-COOKIE'] = ['c=3', 'd=4', 'e=5']
+    assert list(response.headers)[1:4] == [
+        ('Set-Cookie', 'c=3'), ('Set-Cookie', 'd=4'), ('Set-Cookie', 'e=5')]
+
+    assert 'set-cookie' in response.headers
+    assert response.headers.get('Vary') == 'Origin'
+    assert response.headers.get('X-Missing', 'abc') == 'abc'
+
+    del response.headers['Set-Cookie']
+    assert 'Set-Cookie' not in response.headers
+    assert list(response.headers) == [
+        ('Content-Type', 'text/plain; charset=utf-8'),
+        ('Vary', 'Origin'), ('X-Other', 'x')]
+    with pytest.raises(KeyError):
+        del response.headers['Set-Cookie']
+
+
 def test_set_cookie():
     response = Response()
     assert list(response.headers) == [('Content-Type',
@@ -99,3 +185,79 @@ def test_set_cookie():
         ('Set-Cookie', 'empty_value='),
         ('Set-Cookie', 'key_only'),
     ]
+
+
+def test_parse_range():
+    assert parse_range('bytes=0-499', 1000) == [(0, 500)]
+    assert parse_range('bytes=500-', 1000) == [(500, 1000)]
+    assert parse_range('bytes=-200', 1000) == [(800, 1000)]
+    assert parse_range('bytes=-2000', 1000) == [(0, 1000)]
+    assert parse_range('bytes=0-0, 900-5000', 1000) == [(0, 1), (900, 1000)]
+    assert parse_range('bytes=1000-', 1000) == []
+    assert parse_range('bytes=-0', 1000) == []
+    for header in ('bytes=5-1', 'items=0-1', 'bytes=a-b', 'bytes=-'):
+        assert parse_range(header, 1000) is None
+    assert parse_range(','.join(['bytes=0-1'] * 17), 1000) is None
+
+
+def test_file_response(tmpdir):
+    path = tmpdir.join('data.txt')
+    path.write_binary(b'0123456789' * 10)
+
+    response = FileResponse(str(path))
+    assert response.headers['Content-Type'] == 'text/plain'
+    assert response.prepare({'REQUEST_METHOD': 'GET'}) is response
+    assert response.headers['Content-Length'] == '100'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    response.chunk_size = 40
+    assert [len(chunk) for chunk in response] == [40, 40, 20]
+    response.close()
+    assert response.file.closed
+
+    # Handed to the server's file wrapper
+    response = FileResponse(str(path))
+    body = response.prepare({'REQUEST_METHOD': 'GET',
+                             'wsgi.file_wrapper': FileWrapper})
+    assert isinstance(body, FileWrapper)
+    assert b''.join(body) == b'0123456789' * 10
+    body.close()
+    assert response.file.closed
+
+    response = FileResponse(io.BytesIO(b'0123456789'))
+    assert response.headers['Content-Type'] == 'application/octet-stream'
+    response.prepare({'REQUEST_METHOD': 'GET', 'HTTP_RANGE': 'bytes=-3'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 7-9/10'
+    assert response.headers['Content-Length'] == '3'
+    assert b''.join(response) == b'789'
+
+    response = FileResponse(io.BytesIO(b'0123456789'))
+    response.prepare({'REQUEST_METHOD': 'GET', 'HTTP_RANGE': 'bytes=10-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */10'
+    assert b''.join(response) == b''
+
+    # A stale If-Range gets the whole file
+    response = FileResponse(io.BytesIO(b'0123456789'))
+    response.headers['ETag'] = '"a"'
+    response.prepare({'REQUEST_METHOD': 'GET', 'HTTP_RANGE': 'bytes=0-1',
+                      'HTTP_IF_RANGE': '"b"'})
+    assert response.status_code == 200
+
+
+def test_file_response_multiple_ranges():
+    response = FileResponse(io.BytesIO(b'0123456789'), mimetype='text/plain')
+    response.prepare({'REQUEST_METHOD': 'GET',
+                      'HTTP_RANGE': 'bytes=0-1,5-6'})
+    assert response.status_code == 206
+    content_type = response.headers['Content-Type']
+    assert content_type.startswith('multipart/byteranges; boundary=')
+    boundary = content_type.split('=')[1].encode('ascii')
+    body = b''.join(response)
+    assert body == (
+        b'\r\n--' + boundary + b'\r\nContent-Type: text/plain\r\n'
+        b'Content-Range: bytes 0-1/10\r\n\r\n01'
+        b'\r\n--' + boundary + b'\r\nContent-Type: text/plain\r\n'
+        b'Content-Range: bytes 5-6/10\r\n\r\n56'
+        b'\r\n--' + boundary + b'--\r\n')
+    assert response.headers['Content-Length'] == str(len(body))
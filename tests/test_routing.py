@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 """Test the router."""
 
-from malt.routing import Router
+from malt.routing import Converter, Router
 import pytest
 import re
+import uuid
 
 
 def test_get_and_post():
@@ -114,3 +115,243 @@ def test_missing_view():
 
     with pytest.raises(KeyError):
         router.path_for(unregistered)
+
+
+def test_first_match_wins():
+    router = Router()
+    views = [lambda: None for _ in range(6)]
+
+    router.add_rule('GET', r'^/a/(\w+)$', views[0])
+    router.add_rule('GET', r'^/a/b$', views[1])
+    router.add_rule('GET', r'^/(\w)/(\d+)$', views[2])
+    router.add_rule('GET', r'^/(?P<x>z)(\d)$', views[3])
+    router.add_rule('GET', r'(?i)^/CASE$', views[4])
+    router.add_rule('GET', r'^/(a|b)/(c)?d$', views[5])
+
+    assert router.get_view('GET', '/a/b') == (views[0], ('b',))
+    assert router.get_view('GET', '/a/12') == (views[0], ('12',))
+    assert router.get_view('GET', '/b/12') == (views[2], ('b', '12'))
+    assert router.get_view('GET', '/z1') == (views[3], ('z', '1'))
+    assert router.get_view('GET', '/case') == (views[4], ())
+    assert router.get_view('GET', '/b/d') == (views[5], ('b', None))
+    assert router.get_view('GET', '/a/cd') == (views[0], ('cd',))
+    assert router.get_view('GET', '/a/b\n') == (views[0], ('b',))
+
+    with pytest.raises(LookupError):
+        router.get_view('GET', '/c/d')
+
+    # Either side of a top-level alternation can match
+    router.add_rule('GET', r'^/users/(\d+)$|^/people/(\d+)$', views[0])
+    router.add_rule('GET', r'^/people/[|]$', views[1])
+    assert router.get_view('GET', '/users/3') == (views[0], ('3', None))
+    assert router.get_view('GET', '/people/3') == (views[0], (None, '3'))
+    assert router.get_view('GET', '/people/|') == (views[1], ())
+
+
+def test_many_routes():
+    router = Router()
+    views = {}
+    for i in range(300):
+        views[i] = lambda: None
+        router.add_rule('GET', r'^/r{0:d}/(\d+)/(\w+)$'.format(i), views[i])
+    router.add_rule('GET', r'^/(\w+)$', views[0])
+
+    for i in range(300):
+        path = '/r{0:d}/{0:d}/x'.format(i)
+        assert router.get_view('GET', path) == (views[i], (str(i), 'x'))
+    assert router.get_view('GET', '/r5') == (views[0], ('r5',))
+
+    # Adding a rule invalidates the compiled dispatch table
+    router.add_rule('GET', r'^/r0/late$', views[1])
+    assert router.get_view('GET', '/r0/late') == (views[1], ())
+
+
+def test_literal_routes():
+    router = Router()
+
+    def dynamic():
+        pass
+
+    def literal():
+        pass
+
+    def shadowed():
+        pass
+
+    router.add_rule('GET', r'^/tasks$', literal)
+    router.add_rule('POST', r'^/tasks$', literal)
+    router.add_rule('GET', r'^/(\w+)/(\d+)$', dynamic)
+    router.add_rule('GET', r'^/x/1$', shadowed)
+    router.add_rule('GET', r'^/a\.b$', literal)
+
+    # Lookups from other threads never see a partial table
+    seen = []
+    match = router._match
+
+    def spy(path, compiled=None):
+        seen.append(router._compiled)
+        return match(path, compiled)
+    router._match = spy
+    static, _, _ = router.compile()
+    assert seen == [None, None, None]
+    del router._match
+    assert dict((path, t[0]) for path, t in static.items()) == {
+        '/tasks': {'GET': literal, 'POST': literal},
+        '/a.b': {'GET': literal},
+    }
+
+    assert router.get_view('GET', '/tasks') == (literal, ())
+    assert router.get_view('POST', '/tasks') == (literal, ())
+    assert router.get_view('GET', '/tasks\n') == (literal, ())
+    assert router.get_view('GET', '/a.b') == (literal, ())
+    assert router.get_view('GET', '/x/1') == (dynamic, ('x', '1'))
+
+    with pytest.raises(LookupError):
+        router.get_view('GET', '/a-b')
+
+
+def test_lookup_cache():
+    router = Router(cache_size=2)
+
+    def get_thing(t):
+        pass
+
+    router.add_rule('GET', r'^/things/(\d+)$', get_thing)
+    assert router.cache_info() == (0, 0, 2, 0)
+
+    for _ in range(3):
+        assert router.get_view('GET', '/things/1') == (get_thing, ('1',))
+    assert router.cache_info() == (2, 1, 2, 1)
+
+    for _ in range(2):
+        with pytest.raises(LookupError) as exc_info:
+            router.get_view('GET', '/nothing')
+        assert str(exc_info.value) == 'No such path'
+        with pytest.raises(LookupError) as exc_info:
+            router.get_view('POST', '/things/1')
+        assert str(exc_info.value) == 'No such method'
+    assert router.cache_info() == (4, 3, 2, 2)
+
+    router.get_view('GET', '/things/2')
+    router.get_view('GET', '/things/3')
+    assert router.cache_info() == (4, 5, 2, 2)
+
+    router.add_rule('POST', r'^/things/(\d+)$', get_thing)
+    assert router.cache_info() == (0, 0, 2, 0)
+    assert router.get_view('POST', '/things/1') == (get_thing, ('1',))
+
+
+def test_converters():
+    router = Router()
+
+    def by_id(i):
+        pass
+
+    def by_uuid(u):
+        pass
+
+    def by_slug(s):
+        pass
+
+    def files(n, p):
+        pass
+
+    def fallback(x):
+        pass
+
+    router.add_rule('GET', r'^/things/<int>$', by_id)
+    router.add_rule('GET', r'^/things/<uuid>$', by_uuid)
+    router.add_rule('GET', r'^/things/<slug>$', by_slug)
+    router.add_rule('GET', r'^/files/(\w+)/<path>$', files)
+    router.add_rule('GET', r'^/(?P<int>.*)$', fallback)
+
+    assert router.get_view('GET', '/things/12') == (by_id, (12,))
+    u = '12345678-1234-5678-1234-567812345678'
+    assert router.get_view('GET', '/things/' + u) == (
+        by_uuid, (uuid.UUID(u),))
+    assert router.get_view('GET', '/things/a-b_c') == (by_slug, ('a-b_c',))
+    assert router.get_view('GET', '/things/a.b') == (fallback,
+                                                     ('things/a.b',))
+    assert router.get_view('GET', '/files/x/a/b.txt') == (files,
+                                                          ('x', 'a/b.txt'))
+    assert router.path_for(by_id) == r'^/things/<int>$'
+
+
+def test_converter_fall_through():
+    router = Router()
+
+    class Even(Converter):
+        regex = r'\d+'
+
+        def to_python(self, value):
+            if int(value) % 2:
+                raise ValueError(value)
+            return int(value)
+
+    def even(n):
+        pass
+
+    def other(n):
+        pass
+
+    router.converters['even'] = Even()
+    router.add_rule('GET', r'^/n/<even>$', even)
+    router.add_rule('GET', r'^/n/(\w+)$', other)
+
+    assert router.get_view('GET', '/n/4') == (even, (4,))
+    assert router.get_view('GET', '/n/5') == (other, ('5',))
+    assert router.get_view('GET', '/n/5\n') == (other, ('5',))
+
+
+def test_match():
+    router = Router()
+
+    def get_root():
+        pass
+
+    def put_thing(t):
+        pass
+
+    router.add_rule('GET', r'^/$', get_root)
+    router.add_rule('POST', r'^/$', get_root)
+    router.add_rule('PUT', r'^/things/<int>$', put_thing)
+    re.purge()
+    router.add_rule('DELETE', r'^/things/<int>$', put_thing)
+
+    assert router.match('GET', '/') == (get_root, (), None)
+    assert router.match('PUT', '/things/3') == (put_thing, (3,), None)
+    assert router.match('GET', '/nothing') == (None, (), None)
+    assert router.match('PATCH', '/') == (None, (), 'GET, POST')
+    assert router.match('GET', '/things/3') == (None, (), 'DELETE, PUT')
+
+
+def test_build():
+    router = Router()
+
+    def view():
+        pass
+
+    def things(*args):
+        pass
+
+    def files(*args):
+        pass
+
+    def optional(*args):
+        pass
+
+    router.add_rule('GET', r'^/a\.b/\{c\}$', view)
+    router.add_rule('GET', r'^/things/<int>/(?P<name>[^/]+)$', things)
+    router.add_rule('GET', r'^/files/<uuid>/<path>\Z', files)
+    router.add_rule('GET', r'^/optional/?$', optional)
+
+    assert router.build(view) == '/a.b/{c}'
+    assert router.build(things, (12, u'é&')) == '/things/12/%C3%A9%26'
+    u = uuid.UUID('12345678-1234-5678-1234-567812345678')
+    assert router.build(files, (u, 'a b/c.txt')) == \
+        '/files/12345678-1234-5678-1234-567812345678/a%20b/c.txt'
+
+    with pytest.raises(TypeError):
+        router.build(things, (1,))
+    with pytest.raises(ValueError):
+        router.build(optional)
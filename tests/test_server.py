@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""Test the asyncio HTTP server."""
+
+from malt import FileResponse, Malt, Response
+from malt.server import HTTPServer, Prefork
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+
+app = Malt()
+
+
+@app.get('^/$')
+def root(request):
+    return Response('Hello World!\n')
+
+
+@app.post('^/echo$')
+def echo(request):
+    return Response(request.data())
+
+
+@app.get('^/stream$')
+def stream(request):
+    def gen():
+        yield 'a'
+        yield 'b'
+    return Response(gen())
+
+
+@app.get('^/file$')
+def file(request):
+    return FileResponse(__file__, mimetype='text/plain')
+
+
+async def streaming(scope, receive, send):
+    """A plain ASGI app, with a response of unknown length."""
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': []})
+    for chunk in (b'a', b'b'):
+        await send({'type': 'http.response.body', 'body': chunk,
+                    'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def exchange(data, asgi=app, **kwargs):
+    """Send raw data to a fresh server, and return everything it sends."""
+    async def go():
+        server = HTTPServer(asgi, keep_alive_timeout=1, **kwargs)
+        listener = await server.start('127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(data)
+        received = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        await server.shutdown(1)
+        return received
+    return asyncio.run(go())
+
+
+def responses(raw):
+    """Split raw HTTP/1.1 responses, and strip their Date headers."""
+    out = []
+    while raw:
+        head, _, raw = raw.partition(b'\r\n\r\n')
+        lines = [line for line in head.split(b'\r\n')
+                 if not line.startswith(b'Date')]
+        headers = dict(line.split(b': ', 1) for line in lines[1:])
+        if b'Content-Length' in headers:
+            n = int(headers[b'Content-Length'])
+            body, raw = raw[:n], raw[n:]
+        else:
+            body, raw = raw, b''
+        out.append((lines[0], headers, body))
+    return out
+
+
+def test_pipelining():
+    raw = exchange(b'GET / HTTP/1.1\r\nHost: x\r\n\r\n'
+                   b'POST /echo HTTP/1.1\r\nContent-Length: 3\r\n\r\nabc'
+                   b'GET /missing HTTP/1.1\r\n\r\n'
+                   b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+    (s1, h1, b1), (s2, _, b2), (s3, _, _), (s4, h4, b4) = responses(raw)
+    assert s1 == b'HTTP/1.1 200 OK'
+    assert b1 == b'Hello World!\n'
+    assert b'Connection' not in h1
+    assert b2 == b'abc'
+    assert s3 == b'HTTP/1.1 404 Not Found'
+    assert h4[b'Connection'] == b'close'
+    assert b4 == b'Hello World!\n'
+
+
+def test_chunked():
+    raw = exchange(b'POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n'
+                   b'Content-Length: 5\r\n\r\n5\r\nhello\r\n0\r\n\r\n')
+    assert raw.startswith(b'HTTP/1.1 400 Bad Request')
+
+    # Any case, and after other headers
+    raw = exchange(b'POST /echo HTTP/1.1\r\nTransfer-Encoding: Chunked\r\n'
+                   b'Connection: close\r\n\r\n3\r\nabc\r\n0\r\n\r\n')
+    [(status, _, body)] = responses(raw)
+    assert status == b'HTTP/1.1 200 OK'
+    assert body == b'abc'
+
+    raw = exchange(b'GET /stream HTTP/1.1\r\nConnection: close\r\n\r\n')
+    head, _, body = raw.partition(b'\r\n\r\n')
+    assert b'Transfer-Encoding: chunked' in head
+    assert body == b'1\r\na\r\n1\r\nb\r\n0\r\n\r\n'
+
+
+def test_head():
+    raw = exchange(b'HEAD / HTTP/1.1\r\n\r\n'
+                   b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n',
+                   streaming)
+    head, get = raw.split(b'\r\n\r\n', 1)
+    assert head.startswith(b'HTTP/1.1 200 OK')
+    assert b'Transfer-Encoding' not in head
+    assert get.startswith(b'HTTP/1.1 200 OK')
+    assert get.endswith(b'\r\n\r\n1\r\na\r\n1\r\nb\r\n0\r\n\r\n')
+
+
+def test_disconnect():
+    events = []
+
+    async def listening(scope, receive, send):
+        await receive()
+        # Returns once the client leaves, or the response is over
+        disconnect = asyncio.ensure_future(receive())
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': []})
+        await send({'type': 'http.response.body', 'body': b'a',
+                    'more_body': True})
+        if scope['path'] == '/wait':
+            events.append((await disconnect)['type'])
+            return
+        await asyncio.sleep(0.05)
+        events.append(disconnect.done())
+        await send({'type': 'http.response.body', 'body': b'b'})
+        events.append((await disconnect)['type'])
+
+    raw = exchange(b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n',
+                   listening)
+    assert raw.endswith(b'\r\n\r\n1\r\na\r\n1\r\nb\r\n0\r\n\r\n')
+    assert events == [False, 'http.disconnect']
+
+    async def go():
+        server = HTTPServer(listening)
+        listener = await server.start('127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /wait HTTP/1.1\r\n\r\n')
+        await reader.readuntil(b'1\r\na\r\n')
+        writer.close()
+        await server.shutdown(1)
+    del events[:]
+    asyncio.run(go())
+    assert events == ['http.disconnect']
+
+
+def test_framing():
+    # Requests that another server could read differently are refused,
+    # not split into two
+    for head in (b'Content-Length: 5\r\nContent-Length: 0',
+                 b'Content-Length: +5', b'Content-Length: 0_5',
+                 b'Content-Length:  5 x', b'Transfer-Encoding: chunked, gzip',
+                 b'Transfer-Encoding: chunked\r\nTransfer-Encoding: x'):
+        raw = exchange(b'POST /echo HTTP/1.1\r\n' + head +
+                       b'\r\n\r\nhelloGET / HTTP/1.1\r\n\r\n')
+        [(status, _, _)] = responses(raw)
+        assert status == b'HTTP/1.1 400 Bad Request'
+
+    raw = exchange(b'POST /echo HTTP/1.1\r\nTransfer-Encoding: gzip, '
+                   b'chunked\r\n\r\n0\r\n\r\n')
+    assert raw.startswith(b'HTTP/1.1 501 Not Implemented')
+
+    # Repeats that agree are fine
+    raw = exchange(b'POST /echo HTTP/1.1\r\nContent-Length: 5\r\n'
+                   b'Content-Length: 5\r\nConnection: close\r\n\r\nhello')
+    assert responses(raw)[0][2] == b'hello'
+
+
+def test_sendfile():
+    with open(__file__, 'rb') as f:
+        source = f.read()
+    raw = exchange(b'GET /file HTTP/1.1\r\n\r\n'
+                   b'GET /file HTTP/1.1\r\nRange: bytes=10-19\r\n'
+                   b'Connection: close\r\n\r\n')
+    (s1, h1, b1), (s2, h2, b2) = responses(raw)
+    assert b1 == source
+    assert h1[b'Content-Length'] == str(len(source)).encode()
+    assert s2 == b'HTTP/1.1 206 Partial Content'
+    assert b2 == source[10:20]
+
+
+def test_expect_continue():
+    raw = exchange(b'POST /echo HTTP/1.1\r\nContent-Length: 3\r\n'
+                   b'Expect: 100-continue\r\n\r\nabc')
+    assert raw.startswith(b'HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK')
+
+    # Answered without reading the body, so there's no interim response
+    raw = exchange(b'POST / HTTP/1.1\r\nContent-Length: 3\r\n'
+                   b'Expect: 100-continue\r\n\r\n')
+    [(status, headers, _)] = responses(raw)
+    assert status == b'HTTP/1.1 405 Method Not Allowed'
+    assert headers[b'Connection'] == b'close'
+
+
+def test_http_1_0():
+    raw = exchange(b'GET / HTTP/1.0\r\n\r\n')
+    [(status, headers, body)] = responses(raw)
+    assert status == b'HTTP/1.1 200 OK'
+    assert headers[b'Connection'] == b'close'
+    assert body == b'Hello World!\n'
+
+
+def test_limits():
+    raw = exchange(b'GET / HTTP/1.1\r\nX-Big: ' + b'x' * 2000 + b'\r\n\r\n',
+                   max_header_size=1024)
+    assert raw.startswith(b'HTTP/1.1 431 Request Header Fields Too Large')
+
+    raw = exchange(b'POST /echo HTTP/1.1\r\nContent-Length: 2000\r\n\r\n',
+                   max_body_size=1024)
+    assert raw.startswith(b'HTTP/1.1 413 Request Entity Too Large')
+
+    # Checked before the chunk is read, and answered by the app
+    raw = exchange(b'POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n'
+                   b'\r\n4000000\r\nabc', max_body_size=1024)
+    [(status, headers, _)] = responses(raw)
+    assert status == b'HTTP/1.1 413 Request Entity Too Large'
+    assert headers[b'Connection'] == b'close'
+
+    raw = exchange(b'GET / HTTP/2.0\r\n\r\n')
+    assert raw.startswith(b'HTTP/1.1 505 HTTP Version Not Supported')
+
+    raw = exchange(b'nonsense\r\n\r\n')
+    assert raw.startswith(b'HTTP/1.1 400 Bad Request')
+
+
+def test_prefork(tmpdir):
+    script = tmpdir.join('serve.py')
+    script.write('\n'.join([
+        'from malt import Malt, Response',
+        'from malt.server import run',
+        'import os, sys',
+        'app = Malt()',
+        '@app.get("^/$")',
+        'def pid(request):',
+        '    return Response(str(os.getpid()))',
+        'run(app, "127.0.0.1", int(sys.argv[1]), workers=2)',
+    ]))
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    def get_pid():
+        for _ in range(100):
+            try:
+                conn = socket.create_connection(('127.0.0.1', port))
+            except OSError:
+                time.sleep(0.05)
+                continue
+            conn.sendall(b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+            data = b''
+            while True:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            conn.close()
+            return int(data.split(b'\r\n\r\n', 1)[1])
+        raise AssertionError('Server did not start')
+
+    proc = subprocess.Popen([sys.executable, str(script), str(port)],
+                            env=dict(os.environ, PYTHONPATH=os.getcwd()))
+    try:
+        first = get_pid()
+        os.kill(first, signal.SIGKILL)
+        # The dead worker gets replaced
+        assert get_pid() != first
+        pids = set(get_pid() for _ in range(10))
+        proc.send_signal(signal.SIGHUP)
+        # The parent may still be throttling the respawn above
+        for _ in range(100):
+            time.sleep(0.1)
+            if not pids & set(get_pid() for _ in range(10)):
+                break
+        else:
+            raise AssertionError('Old workers still serving')
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        assert proc.wait(10) == 0
+
+
+def test_prefork_reap(monkeypatch):
+    prefork = Prefork(None, '127.0.0.1', 0, 2)
+    prefork.pids = {10: (0, 0), 20: (1, 0)}
+    exited = [(10, 0), (20, 0), (0, 0)]
+    monkeypatch.setattr(os, 'waitpid', lambda pid, options: exited.pop(0))
+    spawned = []
+    prefork.spawn = spawned.append
+    # Only the workers being stopped are left dead
+    prefork.reap(stopping=[10])
+    assert spawned == [1]
+    assert prefork.pids == {}
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Test static file serving."""
+
+from malt import Malt, Response
+import gzip
+import pytest
+
+
+@pytest.fixture
+def app(tmpdir):
+    tmpdir.join('app.js').write_binary(b'var a = 1;\n')
+    tmpdir.join('big.bin').write_binary(b'x' * 100)
+    tmpdir.join(u'caf\xe9.txt').write_binary(b'coffee\n')
+    css = tmpdir.mkdir('css')
+    css.join('site.css').write_binary(b'body {}\n')
+    with gzip.open(str(css.join('site.css.gz')), 'wb') as f:
+        f.write(b'body {}\n')
+
+    app = Malt()
+
+    @app.get('^/static/api$')
+    def shadowed(request):
+        return Response('regex')
+
+    app.static('/static', str(tmpdir), max_file_size=50, max_age=60)
+    return app
+
+
+def get(app, path, **headers):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+    for name, value in headers.items():
+        environ['HTTP_' + name.upper()] = value
+    out = {}
+
+    def start_response(status, headers):
+        out['status'] = status
+        out['headers'] = dict(headers)
+
+    body = app.wsgi_app({})(environ, start_response)
+    out['body'] = b''.join(body)
+    if hasattr(body, 'close'):
+        body.close()
+    return out
+
+
+def test_serve(app):
+    rv = get(app, '/static/app.js')
+    assert rv['status'] == '200 OK'
+    assert rv['body'] == b'var a = 1;\n'
+    headers = rv['headers']
+    assert headers['Content-Length'] == '11'
+    assert headers['Cache-Control'] == 'public, max-age=60'
+    assert 'javascript' in headers['Content-Type']
+    assert 'Vary' not in headers
+
+    # From the cache the second time
+    view = app.router.match('GET', '/static/app.js')[0]
+    assert len(view._cache) == 1
+    assert get(app, '/static/app.js')['body'] == b'var a = 1;\n'
+    assert len(view._cache) == 1
+
+    # Large files aren't cached, and support ranges
+    rv = get(app, '/static/big.bin', range='bytes=0-9')
+    assert rv['status'] == '206 Partial Content'
+    assert rv['body'] == b'x' * 10
+    assert get(app, '/static/big.bin')['body'] == b'x' * 100
+    assert len(view._cache) == 1
+
+    assert app.url_for(view, 'css/a b.css') == '/static/css/a%20b.css'
+
+    # PATH_INFO has the UTF-8 bytes of the name, decoded as latin1
+    path = u'/static/caf\xe9.txt'.encode('utf-8').decode('latin1')
+    assert get(app, path)['body'] == b'coffee\n'
+    assert get(app, '/static/caf\xe9.txt')['status'] == '404 Not Found'
+
+
+def test_missing(app):
+    for path in ('/static/nope.js', '/static/../x', '/static/css',
+                 '/static/css/', '/static//app.js'):
+        assert get(app, path)['status'] == '404 Not Found'
+    rv = get(app, '/static/api')
+    assert rv['status'] == '404 Not Found'
+
+    environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/static/app.js'}
+    headers = {}
+    app.wsgi_app({})(environ, lambda s, h: headers.update(h))
+    assert headers['Allow'] == 'GET, HEAD'
+
+
+def test_conditional(app):
+    rv = get(app, '/static/app.js')
+    etag = rv['headers']['ETag']
+    last_modified = rv['headers']['Last-Modified']
+
+    rv = get(app, '/static/app.js', if_none_match=etag)
+    assert rv['status'] == '304 Not Modified'
+    assert rv['body'] == b''
+    assert 'Content-Length' not in rv['headers']
+    assert get(app, '/static/app.js',
+               if_none_match='"other", ' + etag)['status'].startswith('304')
+    assert get(app, '/static/app.js',
+               if_none_match='"other"')['status'] == '200 OK'
+
+    rv = get(app, '/static/app.js', if_modified_since=last_modified)
+    assert rv['status'] == '304 Not Modified'
+    rv = get(app, '/static/app.js',
+             if_modified_since='Thu, 01 Jan 1970 00:00:00 GMT')
+    assert rv['status'] == '200 OK'
+
+
+def test_gzip(app):
+    rv = get(app, '/static/css/site.css', accept_encoding='gzip, br')
+    assert rv['headers']['Content-Encoding'] == 'gzip'
+    assert rv['headers']['Vary'] == 'Accept-Encoding'
+    assert rv['headers']['Content-Type'] == 'text/css'
+    assert gzip.decompress(rv['body']) == b'body {}\n'
+
+    for accept in ('', 'gzip;q=0', 'br'):
+        rv = get(app, '/static/css/site.css', accept_encoding=accept)
+        assert 'Content-Encoding' not in rv['headers']
+        assert rv['headers']['Vary'] == 'Accept-Encoding'
+        assert rv['body'] == b'body {}\n'
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 """Test out the utility functions."""
 
-from malt import json
+from malt import json, Malt
+from malt.util import json_stream_response, ndjson_response
+import io
+import json as stdlib_json
 
 
 def test_json():
@@ -16,3 +19,84 @@ def test_pretty_json():
 
     assert resp.headers['Content-Type'] == 'application/json; charset=utf-8'
     assert list(resp) == [b'{\n  "greeting": "Hello World!"\n}\n']
+
+
+def test_json_encoding():
+    resp = json({'b': u'☃', 'a': 1})
+    assert list(resp) == [b'{"a":1,"b":"\xe2\x98\x83"}\n']
+    assert resp.headers['Content-Length'] == '18'
+
+    resp = json({'b': 1, 'a': 2}, sort_keys=False)
+    assert list(resp) == [b'{"b":1,"a":2}\n']
+
+    resp = json([1, 2], indent=1, code=201)
+    assert list(resp) == [b'[\n 1,\n 2\n]\n']
+    assert resp.status_code == 201
+
+
+def test_json_backend():
+    class Backend(object):
+        def loads(self, data):
+            return ('loaded', data)
+
+        def dumps(self, obj, sort_keys=False, pretty=False):
+            return repr((obj, sort_keys, pretty)).encode('utf-8')
+
+    app = Malt()
+    app.json_backend = Backend()
+    app.json_sort_keys = False
+    resp = app.json_response(1, pretty=True)
+    assert list(resp) == [b'(1, False, True)\n']
+    assert resp.headers['Content-Length'] == '17'
+    resp = app.json_response(1, sort_keys=True)
+    assert list(resp) == [b'(1, True, False)\n']
+
+    # Request bodies are decoded with the same backend
+    @app.post('^/$')
+    def echo(request):
+        return app.json_response(request.json())
+
+    environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': '/',
+               'CONTENT_LENGTH': '2'}
+    for wsgi in (app.wsgi_app({}), app.freeze({})):
+        environ['wsgi.input'] = io.BytesIO(b'[]')
+        body = b''.join(wsgi(environ, lambda status, headers: None))
+        assert body == b"(('loaded', b'[]'), False, False)\n"
+
+
+def test_json_stream():
+    resp = json_stream_response(({'n': i} for i in range(5)), chunk_size=16)
+    assert resp.headers['Content-Type'] == 'application/json; charset=utf-8'
+    chunks = list(resp)
+    assert chunks == [b'[{"n":0}', b',{"n":1},{"n":2}', b',{"n":3},{"n":4}',
+                      b']\n']
+    assert stdlib_json.loads(b''.join(chunks).decode('utf-8')) == [
+        {'n': i} for i in range(5)]
+    assert list(json_stream_response([])) == [b'[]\n']
+
+    # The source is closed, even if the response isn't read to the end
+    closed = []
+
+    def rows():
+        try:
+            for i in range(1000):
+                yield i
+        finally:
+            closed.append(True)
+
+    body = iter(json_stream_response(rows(), chunk_size=4).response)
+    assert next(body) == b'[0'
+    body.close()
+    assert closed == [True]
+
+
+def test_ndjson():
+    resp = ndjson_response(iter([{'b': 1, 'a': 2}, [3]]))
+    assert resp.headers['Content-Type'] == 'application/x-ndjson; ' \
+        'charset=utf-8'
+    assert b''.join(resp) == b'{"a":2,"b":1}\n[3]\n'
+
+    app = Malt()
+    app.json_sort_keys = False
+    resp = app.ndjson_response([{'b': 1, 'a': 2}], chunk_size=1)
+    assert list(resp) == [b'{"b":1,"a":2}\n']